@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Per-sender token-bucket admission control for the printer portals.
+
+Every sender gets a bucket that refills at a steady rate. A job that finds
+enough tokens is admitted right away, one that would only have to wait a
+little is deferred until its tokens arrive, and anything beyond that is
+rejected so a single sender can't flood the print queue.
+"""
+import threading
+import time
+
+BUCKET_RATE = 0.5  # tokens per second
+BUCKET_BURST = 10  # tokens a quiet sender can save up
+MAX_DEFER = 60  # seconds a job may wait for tokens before it is rejected
+
+TEXT_COST = 1
+IMAGE_COST = 5
+
+ADMIT = 'admit'
+DEFER = 'defer'
+REJECT = 'reject'
+
+
+class TokenBucket:
+    def __init__(self, rate=BUCKET_RATE, burst=BUCKET_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost):
+        """Take cost tokens (possibly going into debt) and return the wait in seconds"""
+        self._refill(time.monotonic())
+        self.tokens -= cost
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def refund(self, cost):
+        self.tokens = min(self.burst, self.tokens + cost)
+
+    def level(self):
+        self._refill(time.monotonic())
+        return self.tokens
+
+
+class AdmissionControl:
+    def __init__(self, rate=BUCKET_RATE, burst=BUCKET_BURST, max_defer=MAX_DEFER):
+        self.rate = rate
+        self.burst = burst
+        self.max_defer = max_defer
+        self.buckets = {}
+        self.deferred = {}  # sender -> jobs waiting for tokens
+        self.rejected = {}  # sender -> rejected job count
+        self.lock = threading.Lock()
+
+    def _bucket(self, sender):
+        if sender not in self.buckets:
+            self.buckets[sender] = TokenBucket(self.rate, self.burst)
+        return self.buckets[sender]
+
+    def admit(self, sender, cost, submit):
+        """Run submit() now, later, or never depending on the sender's bucket"""
+        with self.lock:
+            bucket = self._bucket(sender)
+            wait = bucket.reserve(cost)
+            if wait > self.max_defer:
+                bucket.refund(cost)
+                self.rejected[sender] = self.rejected.get(sender, 0) + 1
+                return REJECT, wait
+            if wait > 0:
+                self.deferred[sender] = self.deferred.get(sender, 0) + 1
+
+        if wait <= 0:
+            submit()
+            return ADMIT, 0.0
+
+        def release():
+            with self.lock:
+                self.deferred[sender] -= 1
+            submit()
+
+        timer = threading.Timer(wait, release)
+        timer.daemon = True
+        timer.start()
+        return DEFER, wait
+
+    def deferred_count(self):
+        with self.lock:
+            return sum(self.deferred.values())
+
+    def snapshot(self):
+        """Bucket level, deferred and rejected counts per sender"""
+        with self.lock:
+            return {
+                sender: {
+                    'tokens': round(bucket.level(), 2),
+                    'deferred': self.deferred.get(sender, 0),
+                    'rejected': self.rejected.get(sender, 0),
+                }
+                for sender, bucket in self.buckets.items()
+            }
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Image throughput of a portal fleet with 1, 2 and 4 instances.
+
+Usage: python3 bench/bench_fleet.py [broker host] [images per run] [seconds per print]
+
+Needs a local MQTT v5 broker with shared subscriptions (e.g. mosquitto 2.x on
+localhost:1883). Each run starts that many `nyc-printer-portal.py --fleet`
+instances in dry-run mode (no lp, each print just takes the given time),
+publishes small test images to images/nyc-boshi and waits until every one
+has been printed. Duplicate prints are counted too - there should be none.
+"""
+import base64
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import paho.mqtt.client as mqtt
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORTAL = os.path.join(ROOT, 'nyc-printer-portal.py')
+IMAGE_TOPIC = "images/nyc-boshi"
+PRINTED_LINE = "Combined image printed successfully"
+
+
+def test_image(index):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), ((index * 37) % 256, (index * 91) % 256, (index * 13) % 256)).save(buffer, 'JPEG')
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
+class Instance:
+    def __init__(self, broker, group, name, print_seconds):
+        self.printed = 0
+        self.ready = threading.Event()
+        self.process = subprocess.Popen(
+            [sys.executable, '-u', PORTAL, '--fleet', group, '--instance', name,
+             '--broker', broker, '--dry-run', str(print_seconds)],
+            cwd=ROOT, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.process.stdout:
+            if 'Subscribed to: $share' in line:
+                self.ready.set()
+            if PRINTED_LINE in line:
+                self.printed += 1
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait(5)
+
+
+def run(broker, count, instances, print_seconds):
+    group = f"bench{uuid.uuid4().hex[:6]}"
+    fleet = [Instance(broker, group, f"{group}-{i}", print_seconds) for i in range(instances)]
+    try:
+        for instance in fleet:
+            if not instance.ready.wait(15):
+                raise RuntimeError("portal instance didn't subscribe in time")
+        time.sleep(1)  # let the startup banners print
+
+        client = mqtt.Client(protocol=mqtt.MQTTv5)
+        client.connect(broker, 1883, 60)
+        client.loop_start()
+        start = time.monotonic()
+        for i in range(count):
+            payload = {"from": f"bench-{i}", "timestamp": time.strftime('%Y-%m-%d %H:%M:%S'),
+                       "filename": f"bench_{i}.jpg", "type": "image", "id": uuid.uuid4().hex,
+                       "data": test_image(i)}
+            client.publish(IMAGE_TOPIC, json.dumps(payload), qos=1)
+
+        deadline = start + count * print_seconds * 2 + 60
+        while sum(i.printed for i in fleet) < count and time.monotonic() < deadline:
+            time.sleep(0.05)
+        elapsed = time.monotonic() - start
+        time.sleep(1)  # catch any late duplicates
+        client.loop_stop()
+        client.disconnect()
+
+        printed = sum(i.printed for i in fleet)
+        return elapsed, printed, [i.printed for i in fleet]
+    finally:
+        for instance in fleet:
+            instance.stop()
+
+
+def main():
+    broker = sys.argv[1] if len(sys.argv) > 1 else 'localhost'
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    print_seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 0.5
+
+    for instances in (1, 2, 4):
+        elapsed, printed, split = run(broker, count, instances, print_seconds)
+        print(f"{instances} instance(s): {min(printed, count)}/{count} images in {elapsed:.1f}s "
+              f"= {min(printed, count) / elapsed:.2f} images/s, split {split}, "
+              f"duplicates {max(printed - count, 0)}")
+
+
+if __name__ == '__main__':
+    main()
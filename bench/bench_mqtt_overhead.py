@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Measure bytes on the wire for the portal's publishes: MQTT 3.1.1 vs v5.
+
+Usage: python3 bench/bench_mqtt_overhead.py [broker host] [broker port] [publishes]
+
+Needs a local broker (e.g. `mosquitto -p 1883`). The script puts a small TCP
+relay in front of the broker that counts bytes in each direction, then runs the
+portal's steady-state traffic (presence heartbeat + queue status) with each
+protocol: plain topics on 3.1.1, topic aliases and expiry properties on v5.
+"""
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import paho.mqtt.client as mqtt
+from mqtt_v5 import TopicAliases, connect_properties
+
+PRESENCE_TOPIC = "presence/nyc-boshi"
+STATUS_TOPIC = "status/nyc-boshi"
+
+
+class CountingRelay:
+    """Forwards one TCP connection at a time to the broker, counting bytes"""
+
+    def __init__(self, broker_host, broker_port):
+        self.broker = (broker_host, broker_port)
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.sent = 0  # client -> broker
+        self.received = 0  # broker -> client
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            client_sock, _ = self.listener.accept()
+            broker_sock = socket.create_connection(self.broker)
+            threading.Thread(target=self._pipe, args=(client_sock, broker_sock, 'sent'), daemon=True).start()
+            threading.Thread(target=self._pipe, args=(broker_sock, client_sock, 'received'), daemon=True).start()
+
+    def _pipe(self, src, dst, counter):
+        try:
+            while True:
+                data = src.recv(65536)
+                if not data:
+                    break
+                setattr(self, counter, getattr(self, counter) + len(data))
+                dst.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for sock in (src, dst):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def reset(self):
+        self.sent = 0
+        self.received = 0
+
+
+def run(relay, use_v5, count):
+    connected = threading.Event()
+    aliases = TopicAliases([PRESENCE_TOPIC, STATUS_TOPIC], enabled=use_v5)
+
+    def on_connect(client, userdata, flags, rc, properties=None):
+        aliases.reset(properties)
+        connected.set()
+
+    if use_v5:
+        client = mqtt.Client(client_id="bench-v5", protocol=mqtt.MQTTv5)
+    else:
+        client = mqtt.Client(client_id="bench-v311", protocol=mqtt.MQTTv311)
+    client.on_connect = on_connect
+
+    relay.reset()
+    if use_v5:
+        client.connect('127.0.0.1', relay.port, 60, properties=connect_properties(2))
+    else:
+        client.connect('127.0.0.1', relay.port, 60)
+    client.loop_start()
+    connected.wait(5)
+    handshake = relay.sent
+
+    status = json.dumps({'printer': 'idle', 'queue_depth': 0, 'deferred': 0, 'drain_seconds': 0.0,
+                         'saturated': False, 'senders': {}, 'updated': time.time()})
+    for _ in range(count):
+        aliases.publish(client, PRESENCE_TOPIC, "online", content_type='presence', retain=True)
+        aliases.publish(client, STATUS_TOPIC, status, content_type='status', retain=True).wait_for_publish()
+    time.sleep(0.5)
+    steady = relay.sent - handshake
+
+    client.disconnect()
+    client.loop_stop()
+    return handshake, steady
+
+
+def main():
+    host = sys.argv[1] if len(sys.argv) > 1 else 'localhost'
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 1883
+    count = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+
+    relay = CountingRelay(host, port)
+    results = {}
+    for name, use_v5 in (('MQTT 3.1.1', False), ('MQTT v5', True)):
+        handshake, steady = run(relay, use_v5, count)
+        results[name] = steady
+        print(f"{name:<10}  connect {handshake:>5} B   {count} heartbeat+status pairs {steady:>8} B "
+              f"({steady / count:.1f} B/pair)")
+
+    saved = results['MQTT 3.1.1'] - results['MQTT v5']
+    print(f"v5 saves {saved} B ({saved * 100 / results['MQTT 3.1.1']:.1f}%) of publish traffic "
+          f"while also carrying expiry intervals")
+
+
+if __name__ == '__main__':
+    main()
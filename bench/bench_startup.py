@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Startup cost of the portal and sender, and cold start to first message.
+
+Usage: python3 bench/bench_startup.py [broker host] [runs]
+
+Part 1 needs no broker: it runs each entry point under `python -X importtime`
+and prints the wall time and the slowest top-level imports, next to what the
+heavy modules (paho, PIL, cv2, NumPy) would cost if they were loaded eagerly.
+
+Part 2 needs a local MQTT v5 broker (e.g. mosquitto on localhost:1883). It
+measures launch (or /start, for a resident portal on --standby) until the
+portal is connected and until it has handled its first text message.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PORTAL = os.path.join(ROOT, 'nyc-printer-portal.py')
+SENDER = os.path.join(ROOT, 'terminal', 'ascii-cam-sender.py')
+MESSAGE_TOPIC = "messages/nyc-boshi"
+HEAVY = "import paho.mqtt.client, PIL.Image, cv2, numpy"
+TOP_IMPORTS = 8
+
+ENTRY_POINTS = [
+    ('portal', [PORTAL, '--help']),
+    ('sender (before capture)', [SENDER]),
+    ('heavy modules, eager', ['-c', HEAVY]),
+]
+
+
+def import_breakdown(args):
+    """Run once under -X importtime; returns (wall seconds, {top-level package: cumulative us})"""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', *args], cwd=ROOT,
+                            capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.startswith('  '):
+            continue  # nested import, already counted in its parent's cumulative time
+        root = name.strip().split('.')[0]
+        packages[root] = packages.get(root, 0) + int(cumulative)
+    if 'Traceback' in result.stderr:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return wall, packages
+
+
+def report_imports(runs):
+    for label, args in ENTRY_POINTS:
+        try:
+            samples = [import_breakdown(args) for _ in range(runs)]
+        except RuntimeError as e:
+            print(f"{label}: failed ({e})")
+            continue
+        wall = statistics.median(wall for wall, _ in samples)
+        _, packages = samples[-1]
+        total = sum(packages.values())
+        print(f"{label}: {wall * 1000:.0f} ms wall, {total / 1000:.0f} ms importing")
+        for name, us in sorted(packages.items(), key=lambda kv: -kv[1])[:TOP_IMPORTS]:
+            print(f"    {name:<24}{us / 1000:>8.1f} ms")
+
+
+class Portal:
+    """A dry-run portal whose stdout we watch for the cold-start markers"""
+
+    def __init__(self, broker, standby):
+        self.connected = threading.Event()
+        self.handled = threading.Event()
+        self.standing_by = threading.Event()
+        self.process = subprocess.Popen(
+            [sys.executable, '-u', PORTAL, '--broker', broker, '--dry-run', '0',
+             *(['--standby'] if standby else [])],
+            cwd=ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.process.stdout:
+            if 'standby' in line:
+                self.standing_by.set()
+            elif '⏱ connected' in line:
+                self.connected.set()
+            elif '⏱ first message handled' in line:
+                self.handled.set()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait(5)
+
+
+def cold_start(broker, standby):
+    """Seconds from launch (or /start) to connected and to first message handled"""
+    import paho.mqtt.client as mqtt
+
+    client = mqtt.Client(protocol=mqtt.MQTTv5)
+    client.connect(broker, 1883, 60)
+    client.loop_start()
+    started = time.perf_counter()
+    portal = Portal(broker, standby)
+    try:
+        if standby:
+            if not portal.standing_by.wait(30):
+                raise RuntimeError("portal never reached standby")
+            time.sleep(0.5)  # let the warm-up imports settle
+            started = time.perf_counter()
+            portal.process.stdin.write('/start\n')
+            portal.process.stdin.flush()
+        if not portal.connected.wait(30):
+            raise RuntimeError("portal didn't connect")
+        connected = time.perf_counter() - started
+        message = {"id": uuid.uuid4().hex, "from": "bench", "to": "nyc-boshi",
+                   "text": "startup bench", "time": time.strftime('%H:%M:%S')}
+        client.publish(MESSAGE_TOPIC, json.dumps(message), qos=1)
+        if not portal.handled.wait(30):
+            raise RuntimeError("portal didn't handle the message")
+        return connected, time.perf_counter() - started
+    finally:
+        portal.stop()
+        client.loop_stop()
+        client.disconnect()
+
+
+def main():
+    broker = sys.argv[1] if len(sys.argv) > 1 else 'localhost'
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    print("== import time ==")
+    report_imports(runs)
+
+    print("\n== cold start to first message ==")
+    for label, standby in (('fresh process', False), ('resident (--standby, /start)', True)):
+        try:
+            samples = [cold_start(broker, standby) for _ in range(runs)]
+        except Exception as e:
+            print(f"{label}: skipped ({e})")
+            continue
+        print(f"{label}: connected {statistics.median(s[0] for s in samples) * 1000:.0f} ms, "
+              f"first message handled {statistics.median(s[1] for s in samples) * 1000:.0f} ms (median of {runs})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Compare the text print paths: plain text through CUPS vs direct PDF layout.
+
+Usage: python3 bench/bench_text_layout.py [message count]
+
+The CUPS path formats each message like the portal does and runs it through
+`cupsfilter` (text -> PDF, the texttopdf filter), one page per message. The
+layout path packs the same messages with text_layout.py. Run it on the Pi to
+get meaningful numbers; without cupsfilter only the layout path is timed.
+"""
+import importlib.util
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from text_layout import render_messages
+
+SAMPLES = [
+    "hi!",
+    "are you still up? it's almost midnight here",
+    "today we cooked dumplings for the whole floor and everyone asked about the printer 😀",
+    "你好！今天天气很好，我们去公园散步吧。",
+    "ok here is a longer one - the game is set for saturday, bring the cards, the dice and "
+    "whatever snacks you can find at the corner store, we'll print the scores as we go",
+]
+
+
+def load_portal():
+    """Load nyc-printer-portal.py as a module (needs its dependencies installed)"""
+    spec = importlib.util.spec_from_file_location('portal', os.path.join(ROOT, 'nyc-printer-portal.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def time_layout(messages):
+    start = time.perf_counter()
+    pdf, pages = render_messages(messages)
+    return time.perf_counter() - start, pages, len(pdf)
+
+
+def time_cupsfilter(data, mime_in):
+    start = time.perf_counter()
+    subprocess.run(['cupsfilter', '-i', mime_in, '-m', 'application/pdf', '-'],
+                   input=data, capture_output=True, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    messages = [('shanghai-cedar', SAMPLES[i % len(SAMPLES)], '2025-07-01 21:00:00') for i in range(count)]
+
+    # Warm the metric caches once, then time a cold-ish and a warm run
+    layout_time, pages, size = time_layout(messages)
+    warm_time, _, _ = time_layout(messages)
+    print(f"Direct layout: {count} messages -> {pages} page(s), {size} bytes")
+    print(f"  first run {layout_time * 1000:.1f} ms, warm {warm_time * 1000:.1f} ms "
+          f"({warm_time * 1000 / count:.2f} ms/message)")
+
+    if not shutil.which('cupsfilter'):
+        print("cupsfilter not found - skipping the CUPS text path (run this on the portal host)")
+        return
+
+    try:
+        portal = load_portal()
+    except ImportError as e:
+        print(f"Can't load the portal for the CUPS text path: {e}")
+        return
+
+    formatter = portal.PrinterPortal.format_text_message
+    cups_time = 0.0
+    for sender, text, timestamp in messages:
+        cups_time += time_cupsfilter(formatter(None, sender, text, timestamp).encode('utf-8'), 'text/plain')
+    pdf, _ = render_messages(messages)
+    pdf_filter_time = time_cupsfilter(pdf, 'application/pdf')
+
+    print(f"CUPS text path: {count} messages -> {count} page(s)")
+    print(f"  texttopdf {cups_time * 1000:.1f} ms ({cups_time * 1000 / count:.2f} ms/message)")
+    print(f"Direct layout + pdftopdf: {(warm_time + pdf_filter_time) * 1000:.1f} ms "
+          f"({(warm_time + pdf_filter_time) * 1000 / count:.2f} ms/message)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Fleet mode for the printer portals: several instances, one site.
+
+Instances share the site's message and image topics through MQTT shared
+subscriptions ($share/<group>/...), so the broker hands each job to one of
+them. Portals acknowledge a job only after it has printed, so a job held by
+an instance that dies is delivered again: to another group member once the
+dead instance's session ends, or to the instance itself if it comes back
+and resumes its session. Every job is therefore claimed on a retained
+fleet/<site>/claims/<job id> topic before it prints. An instance only prints
+jobs whose claim it won, and never a job that another instance already
+printed or is printing.
+
+Claims are ordered without looking at any host's clock: a claim that has
+started printing wins, and between claims that are still settling the
+lowest instance name wins.
+"""
+import collections
+import hashlib
+import json
+import threading
+import time
+
+CLAIM_SETTLE = 0.5  # seconds to wait for competing claims before printing
+CLAIM_EXPIRY = 24 * 3600  # seconds the broker keeps a retained claim (MQTT v5)
+SEEN_JOBS = 1000  # job ids a portal remembers to drop redelivered messages
+PRINTED = 'printed'
+
+
+def shared_topic(group, topic):
+    return f"$share/{group}/{topic}"
+
+
+def job_id_for(data, payload):
+    """The sender's message id, or a hash of the payload for older senders"""
+    if isinstance(data, dict) and data.get('id'):
+        return str(data['id'])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+class SeenJobs:
+    """Job ids a portal has queued or printed, in fleet mode or not.
+
+    Print jobs are acknowledged only once they've printed, so the broker
+    redelivers queued ones whenever a session resumes; those copies are
+    duplicates. Each accepted delivery gets a token, so a deferred submit can
+    tell whether its delivery was dropped (on /stop) in the meantime.
+    """
+
+    def __init__(self, limit=SEEN_JOBS):
+        self.limit = limit
+        self.jobs = collections.OrderedDict()  # job id -> delivery token, or PRINTED
+        self.lock = threading.Lock()
+
+    def add(self, job_id):
+        """Note a delivery; returns its token, or None for a duplicate"""
+        with self.lock:
+            if job_id in self.jobs:
+                return None
+            token = object()
+            self.jobs[job_id] = token
+            while len(self.jobs) > self.limit:
+                self.jobs.popitem(last=False)
+            return token
+
+    def current(self, job_id, token):
+        """True while token is still the live delivery of job_id"""
+        with self.lock:
+            return self.jobs.get(job_id) is token
+
+    def finished(self, job_id):
+        """The job printed (or was dropped for good): later copies are duplicates"""
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id] = PRINTED
+
+    def forget_unfinished(self):
+        """Forget jobs dropped from the queue (on /stop): they never printed, so a later copy isn't a duplicate"""
+        with self.lock:
+            self.jobs = collections.OrderedDict(
+                (job_id, token) for job_id, token in self.jobs.items() if token is PRINTED)
+
+
+class FleetGuard:
+    def __init__(self, site, group, instance, publish):
+        self.group = group
+        self.instance = instance
+        self.publish = publish  # publish(topic, payload, content_type=None, retain=False)
+        self.claims_prefix = f"fleet/{site}/claims/"
+        self.instances_prefix = f"fleet/{site}/instances/"
+        self.claims = {}  # job id -> {instance: claim}, claim['seen'] is our receive time
+        self.instances = {}  # instance -> 'online' / 'offline'
+        self.mine = {}  # job id -> monotonic time we claimed it
+        self.lock = threading.Lock()
+
+    @property
+    def subscriptions(self):
+        return [self.claims_prefix + '+', self.instances_prefix + '+']
+
+    @property
+    def presence_topic(self):
+        return self.instances_prefix + self.instance
+
+    def shared(self, topic):
+        return shared_topic(self.group, topic)
+
+    def handle(self, topic, payload):
+        """Track claims and instance presence; True if the message was ours to handle"""
+        if topic.startswith(self.instances_prefix):
+            with self.lock:
+                self.instances[topic[len(self.instances_prefix):]] = payload.strip()
+            return True
+        if topic.startswith(self.claims_prefix):
+            try:
+                claim = json.loads(payload)
+            except ValueError:
+                return True
+            job_id = topic[len(self.claims_prefix):]
+            claim['seen'] = time.time()
+            with self.lock:
+                self.claims.setdefault(job_id, {})[claim.get('instance')] = claim
+            return True
+        return False
+
+    def _alive(self, instance):
+        return instance == self.instance or self.instances.get(instance) != 'offline'
+
+    def _publish_claim(self, job_id, state):
+        claim = {'instance': self.instance, 'state': state}
+        with self.lock:
+            self.claims.setdefault(job_id, {})[self.instance] = dict(claim, seen=time.time())
+        self.publish(self.claims_prefix + job_id, json.dumps(claim), content_type='claim', retain=True)
+
+    def claim(self, job_id):
+        """Claim a job when it arrives; False if it's a duplicate we should drop"""
+        with self.lock:
+            if job_id in self.mine:
+                return False  # redelivered to us - already queued once
+            for instance, claim in self.claims.get(job_id, {}).items():
+                if claim.get('state') == 'printed' or (instance != self.instance and self._alive(instance)):
+                    return False
+            self.mine[job_id] = time.monotonic()
+            if len(self.claims) > 1000:
+                self._prune()
+        self._publish_claim(job_id, 'claimed')
+        return True
+
+    def _prune(self):
+        """Forget claims older than the broker keeps them"""
+        cutoff = time.time() - CLAIM_EXPIRY
+        for job_id in list(self.claims):
+            if all(claim.get('seen', 0) < cutoff for claim in self.claims[job_id].values()):
+                del self.claims[job_id]
+                self.mine.pop(job_id, None)
+
+    def won(self, job_id):
+        """Called right before printing: True if our claim beat every live competitor.
+
+        The winner marks the job 'printing', which beats any claim that
+        arrives later, whatever its instance name.
+        """
+        with self.lock:
+            claimed_at = self.mine.get(job_id)
+        if claimed_at is None:
+            return False
+        remaining = CLAIM_SETTLE - (time.monotonic() - claimed_at)
+        if remaining > 0:
+            time.sleep(remaining)
+        with self.lock:
+            claims = self.claims.get(job_id, {})
+            if claims.get(self.instance, {}).get('state') == 'printing':
+                return True  # a retry of a job we already won
+            for instance, claim in claims.items():
+                if instance == self.instance:
+                    continue
+                if claim.get('state') == 'printed':
+                    return False
+                if claim.get('state') == 'printing' and self._alive(instance):
+                    return False
+            contenders = [instance for instance in claims if self._alive(instance)]
+            if contenders and min(contenders) != self.instance:
+                return False
+        self._publish_claim(job_id, 'printing')
+        return True
+
+    def release_unprinted(self):
+        """Forget our unprinted claims so a later delivery of those jobs isn't taken for a duplicate"""
+        with self.lock:
+            self.mine = {
+                job_id: claimed_at for job_id, claimed_at in self.mine.items()
+                if self.claims.get(job_id, {}).get(self.instance, {}).get('state') == 'printed'}
+
+    def printed(self, job_id):
+        self._publish_claim(job_id, 'printed')
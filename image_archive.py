@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Content-addressed archive of received images for the printer portals.
+
+Originals and rendered composites are stored once under their SHA-256 hash, so
+a photo can be reprinted from disk with `/reprint <id>` instead of being sent
+across the Pacific again. A small JSON index keeps sender, time, size and a
+thumbnail per image, and the least recently used images are evicted when the
+archive grows past its disk budget.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+ARCHIVE_DIR = "archive"
+ARCHIVE_BUDGET = 200 * 1024 * 1024  # bytes on disk before LRU eviction
+THUMBNAIL_SIZE = (96, 96)
+ID_LENGTH = 10  # hex chars of the original's hash used as the reprint id
+
+
+class ImageArchive:
+    def __init__(self, root=ARCHIVE_DIR, budget=ARCHIVE_BUDGET):
+        self.root = root
+        self.budget = budget
+        self.objects_dir = os.path.join(root, 'objects')
+        self.index_path = os.path.join(root, 'index.json')
+        self.lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def object_path(self, digest, suffix='.jpg'):
+        return os.path.join(self.objects_dir, digest[:2], digest + suffix)
+
+    def _write_object(self, data, suffix='.jpg'):
+        """Store bytes under their hash (no-op if already present)"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest, suffix)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def _thumbnail(self, image_bytes):
+        try:
+            from PIL import Image  # loaded on the first photo, not at portal startup
+            img = Image.open(io.BytesIO(image_bytes))
+            img.thumbnail(THUMBNAIL_SIZE)
+            buf = io.BytesIO()
+            img.convert('RGB').save(buf, 'JPEG', quality=60)
+            return buf.getvalue()
+        except Exception:
+            return None
+
+    def add_original(self, image_bytes, sender, timestamp, filename):
+        """Archive a received original and return its reprint id"""
+        digest = self._write_object(image_bytes)
+        image_id = digest[:ID_LENGTH]
+        with self.lock:
+            entry = self.index.get(image_id)
+            if entry is None:
+                thumb = self._thumbnail(image_bytes)
+                entry = {
+                    'original': digest,
+                    'composite': None,
+                    'thumbnail': self._write_object(thumb) if thumb else None,
+                    'sender': sender,
+                    'time': timestamp,
+                    'filename': filename,
+                    'size': len(image_bytes),
+                    'received': time.time(),
+                }
+                self.index[image_id] = entry
+            entry['last_used'] = time.time()
+            self._save_index()
+        return image_id
+
+    def add_composite(self, image_id, composite_bytes):
+        """Archive the rendered print composite for an image"""
+        digest = self._write_object(composite_bytes)
+        with self.lock:
+            entry = self.index.get(image_id)
+            if entry is not None:
+                entry['composite'] = digest
+                self._save_index()
+        self.enforce_budget(keep=image_id)  # never evict the image we're about to print
+        return self.object_path(digest)
+
+    def get(self, image_id):
+        """Look up an entry by id (or unique id prefix) and mark it used"""
+        with self.lock:
+            matches = [key for key in self.index if key.startswith(image_id)]
+            if len(matches) != 1:
+                return None, None
+            entry = self.index[matches[0]]
+            entry['last_used'] = time.time()
+            self._save_index()
+            return matches[0], dict(entry)
+
+    def composite_path(self, image_id):
+        """Path of the cached composite, or None if it isn't rendered yet"""
+        with self.lock:
+            entry = self.index.get(image_id)
+            if not entry or not entry.get('composite'):
+                return None
+            path = self.object_path(entry['composite'])
+        return path if os.path.exists(path) else None
+
+    def original_path(self, image_id):
+        with self.lock:
+            entry = self.index.get(image_id)
+            if not entry:
+                return None
+            path = self.object_path(entry['original'])
+        return path if os.path.exists(path) else None
+
+    def recent(self, limit=10):
+        """Most recently received entries, newest first"""
+        with self.lock:
+            items = sorted(self.index.items(), key=lambda kv: kv[1].get('received', 0), reverse=True)
+            return [(key, dict(entry)) for key, entry in items[:limit]]
+
+    def _digests(self, entry):
+        return [d for d in (entry.get('original'), entry.get('composite'), entry.get('thumbnail')) if d]
+
+    def disk_usage(self):
+        total = 0
+        for dirpath, _, filenames in os.walk(self.objects_dir):
+            for name in filenames:
+                total += os.path.getsize(os.path.join(dirpath, name))
+        return total
+
+    def enforce_budget(self, keep=None):
+        """Evict least recently used entries (except keep) until the archive fits the budget"""
+        with self.lock:
+            usage = self.disk_usage()
+            if usage <= self.budget:
+                return 0
+            evicted = 0
+            by_age = sorted(self.index.items(), key=lambda kv: kv[1].get('last_used', 0))
+            for image_id, entry in by_age:
+                if usage <= self.budget:
+                    break
+                if image_id == keep:
+                    continue
+                del self.index[image_id]
+                still_used = {d for e in self.index.values() for d in self._digests(e)}
+                for digest in self._digests(entry):
+                    path = self.object_path(digest)
+                    if digest not in still_used and os.path.exists(path):
+                        usage -= os.path.getsize(path)
+                        os.unlink(path)
+                evicted += 1
+            self._save_index()
+            return evicted
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""MQTT v5 helpers for the printer portals.
+
+Topic aliases let the hot topics (presence heartbeat, queue status) be sent as
+a two-byte number after the first publish on a connection, message expiry
+keeps stale photos from printing hours late, and session expiry lets a
+reconnect resume its subscriptions instead of subscribing all over again.
+"""
+import threading
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+SESSION_EXPIRY = 3600  # seconds the broker keeps our session after a disconnect
+
+# Seconds before the broker drops an undelivered message, per content type
+EXPIRY = {
+    'text': 6 * 3600,
+    'image': 15 * 60,
+    'ascii': 15 * 60,
+    'presence': 15,
+    'status': 60,
+    'claim': 24 * 3600,
+    'clock': 10,
+}
+
+
+def connect_properties(receive_maximum, session_expiry=SESSION_EXPIRY):
+    """CONNECT properties: session expiry and receive-maximum flow control"""
+    props = Properties(PacketTypes.CONNECT)
+    props.SessionExpiryInterval = session_expiry
+    props.ReceiveMaximum = receive_maximum
+    return props
+
+
+def disconnect_properties(session_expiry=0):
+    """DISCONNECT properties: an expiry of 0 ends the session with the connection"""
+    props = Properties(PacketTypes.DISCONNECT)
+    props.SessionExpiryInterval = session_expiry
+    return props
+
+
+def publish_properties(content_type=None, topic_alias=None):
+    """PUBLISH properties for a content type (None if there is nothing to set)"""
+    expiry = EXPIRY.get(content_type)
+    if expiry is None and topic_alias is None:
+        return None
+    props = Properties(PacketTypes.PUBLISH)
+    if expiry is not None:
+        props.MessageExpiryInterval = expiry
+    if topic_alias is not None:
+        props.TopicAlias = topic_alias
+    return props
+
+
+class TopicAliases:
+    """Assigns topic aliases to a fixed list of hot topics, per connection"""
+
+    def __init__(self, hot_topics, enabled=True):
+        self.hot_topics = list(hot_topics)
+        self.enabled = enabled  # False on MQTT 3.1.1 connections
+        self.limit = 0  # TopicAliasMaximum granted by the broker
+        self.announced = set()
+        self.lock = threading.Lock()
+
+    def reset(self, connack_properties=None):
+        """Forget aliases (they only live as long as one connection).
+
+        Called with the CONNACK properties on connect, and without any on
+        disconnect so nothing is sent alias-only until the next CONNACK.
+        """
+        with self.lock:
+            self.limit = getattr(connack_properties, 'TopicAliasMaximum', 0) or 0
+            self.announced = set()
+
+    def publish(self, client, topic, payload, content_type=None, qos=0, retain=False):
+        if not self.enabled:
+            return client.publish(topic, payload, qos=qos, retain=retain)
+        with self.lock:
+            # limit is 0 between a disconnect and the next CONNACK: full topics only
+            alias = None
+            if topic in self.hot_topics and self.hot_topics.index(topic) < self.limit:
+                alias = self.hot_topics.index(topic) + 1
+            props = publish_properties(content_type, alias)
+            if alias is not None:
+                # Send the full topic once to bind the alias, then only the alias
+                if topic in self.announced:
+                    topic = ""
+                else:
+                    self.announced.add(topic)
+            return client.publish(topic, payload, qos=qos, retain=retain, properties=props)
@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+import time
+LAUNCHED = time.time()  # for the cold-start metric (launch to first message handled)
 import warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 import paho.mqtt.client as mqtt
@@ -6,11 +8,19 @@ import json
 import subprocess
 import threading
 import base64
-import tempfile
 import os
+import io
+import sys
+import argparse
 from datetime import datetime
-from PIL import Image, ImageDraw, ImageFont
 from paho.mqtt.client import CallbackAPIVersion
+from print_scheduler import PrintScheduler, PRIORITY_TEXT, PRIORITY_IMAGE, PRIORITY_BANNER
+from image_archive import ImageArchive, ARCHIVE_DIR
+from admission import AdmissionControl, ADMIT, DEFER, TEXT_COST, IMAGE_COST
+from text_layout import render_messages
+from mqtt_v5 import TopicAliases, connect_properties, disconnect_properties
+from fleet import FleetGuard, SeenJobs, job_id_for
+from tracing import TraceLog, ClockSync
 
 # ========= CONFIG =========
 MY_NAME = 'nyc-boshi'
@@ -24,38 +34,143 @@ ASCII_TOPIC = f"ascii/{MY_NAME}"
 IMAGE_TOPIC = f"images/{MY_NAME}"
 PRESENCE_TOPIC = f"presence/{FRIEND_NAME}"
 MY_PRESENCE_TOPIC = f"presence/{MY_NAME}"
+STATUS_TOPIC = f"status/{MY_NAME}"  # retained queue/printer status for senders
+CLOCK_TOPIC = f"clock/{MY_NAME}"  # clock-offset pings and replies for tracing
+FRIEND_CLOCK_TOPIC = f"clock/{FRIEND_NAME}"
 
 HEARTBEAT_INTERVAL = 5  # seconds
+SENDER_WEIGHTS = {FRIEND_NAME: 1.0}  # fair-share weights for the print queue
+SATURATED_DRAIN = 120  # seconds of queued printing before senders should back off
+MQTT_V5 = True  # topic aliases, message expiry and resumable sessions (False = MQTT 3.1.1)
+CLIENT_ID = f"portal-{MY_NAME}"  # stable id so a v5 session can be resumed
+RECEIVE_MAXIMUM = 10  # unacknowledged print jobs we hold at once; each is acked once it has printed, the broker keeps the rest
+TEXT_RENDERER = 'layout'  # 'layout' = packed PDF pages, 'cups' = plain text through CUPS filters
+CUPS_POLL = 1  # seconds between checks on a job we handed to CUPS
+CUPS_TIMEOUT = 600  # seconds before we stop waiting for CUPS to finish a job
+STOP_WAIT = 120  # seconds /stop waits for the job on the printer before disconnecting
+
+def cups_job_id(lp_output):
+    """Job id from lp's "request id is <printer>-<n> (1 file(s))" (None if it isn't there)"""
+    words = lp_output.split()
+    if 'is' not in words[:-1]:
+        return None
+    return words[words.index('is') + 1]
 
 class PrinterPortal:
-    def __init__(self):
-        self.client = mqtt.Client(protocol=mqtt.MQTTv311)
+    def __init__(self, broker=BROKER, printer=PRINTER_NAME, fleet_group=None, instance=None, dry_run=None):
+        self.broker = broker
+        self.printer_name = printer
+        self.dry_run = dry_run  # seconds to pretend each print takes, instead of calling lp
+        self.instance = instance
+        
+        # In fleet mode every instance has its own client id, status topic and spool
+        client_id = f"{CLIENT_ID}-{instance}" if fleet_group else CLIENT_ID
+        self.status_topic = f"{STATUS_TOPIC}/{instance}" if fleet_group else STATUS_TOPIC
+        # Print jobs are acknowledged only after they've printed (see on_message)
+        if MQTT_V5:
+            self.client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5, manual_ack=True)
+        else:
+            self.client = mqtt.Client(client_id=client_id if fleet_group else "", protocol=mqtt.MQTTv311,
+                                      manual_ack=True)
+        self.aliases = TopicAliases([MY_PRESENCE_TOPIC, self.status_topic], enabled=MQTT_V5)
+        self.fleet = None
+        if fleet_group:
+            self.fleet = FleetGuard(MY_NAME, fleet_group, instance, self.publish)
+            self.client.will_set(self.fleet.presence_topic, "offline", retain=True)
         self.is_online = False
+        self.scheduler = PrintScheduler(SENDER_WEIGHTS, on_change=self.publish_status)
+        self.admission = AdmissionControl()
+        self.seen = SeenJobs()  # drops messages the broker redelivers after a reconnect
+        self.connection = 0  # bumped on every CONNACK; acks only go out on the same connection
+        self.printer_state = 'idle'
+        self.cups_jobs = 0  # jobs in CUPS's queue for our printer, ours included
+        self.heartbeat_running = False
+        self.active = False  # connected (or connecting) and announcing ourselves online
+        self.start_requested = threading.Event()  # /start in standby mode
+        self.started_at = LAUNCHED
+        self.startup = {}  # cold-start metrics, seconds since launch (or /start)
+        self.banner_printed = False
+        self.archive = ImageArchive(os.path.join(ARCHIVE_DIR, instance)) if fleet_group else ImageArchive()
+        self.traces = TraceLog(MY_NAME)
+        self.clock = ClockSync(MY_NAME, FRIEND_NAME, self.traces)
         
         # Setup MQTT callbacks
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        self.client.on_disconnect = self.on_disconnect
         
         print("🖨️  NYC Printer Portal Starting...")
         
-    def print_to_hp(self, content):
+    def lp(self, *options, data=None, trace_ids=()):
+        """Run lp and wait until CUPS has printed the job (or just wait, in dry-run mode).
+
+        Waiting keeps CUPS's own queue empty, so the scheduler's order is the
+        order things come out of the printer.
+        """
+        job = None
+        if self.dry_run is not None:
+            time.sleep(self.dry_run)
+            process = subprocess.CompletedProcess(['lp'], 0, b'', b'')
+        else:
+            process = subprocess.run(['lp', '-d', self.printer_name, *options], input=data, capture_output=True)
+            if process.returncode == 0:
+                job = cups_job_id(process.stdout.decode('utf-8', 'replace'))
+        if process.returncode != 0:
+            return process
+        for trace_id in trace_ids:
+            self.traces.record(trace_id, 'submit')
+        # Without a CUPS job id we can't tell when it printed, so no printed stage
+        printed = self.dry_run is not None
+        if job:
+            printed = self.wait_for_cups(job) and self.cups_completed(job)
+        if printed:
+            for trace_id in trace_ids:
+                self.traces.record(trace_id, 'printed')
+        return process
+    
+    def wait_for_cups(self, job):
+        """Block until a CUPS job has left the printer's queue; False on timeout"""
+        deadline = time.monotonic() + CUPS_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                result = subprocess.run(['lpstat', '-o', self.printer_name],
+                                        capture_output=True, text=True, timeout=5)
+            except Exception:
+                return False
+            if not any(line.split()[0] == job for line in result.stdout.splitlines() if line.strip()):
+                return True
+            time.sleep(CUPS_POLL)
+        print(f"⚠ {job} still hasn't printed after {CUPS_TIMEOUT}s, moving on")
+        return False
+    
+    def cups_completed(self, job):
+        """True if CUPS lists the job as completed (not cancelled or aborted)"""
+        try:
+            result = subprocess.run(['lpstat', '-W', 'completed', '-o', self.printer_name],
+                                    capture_output=True, text=True, timeout=5)
+        except Exception:
+            return False
+        return any(line.split()[0] == job for line in result.stdout.splitlines() if line.strip())
+    
+    def trace_received(self, data, received):
+        """Log a message's trace (sender stages + our receive time); returns its trace id"""
+        trace = data.get('trace') if isinstance(data, dict) else None
+        if not isinstance(trace, dict) or not trace.get('id'):
+            return None
+        self.traces.record_trace(trace)
+        self.traces.record(trace['id'], 'portal_receive', received)
+        return trace['id']
+    
+    def print_to_hp(self, content, trace_ids=()):
         """Print text content to HP printer"""
         try:
-            process = subprocess.Popen(
-                ['lp', '-d', PRINTER_NAME],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            stdout, stderr = process.communicate(input=content)
+            process = self.lp(data=content.encode('utf-8'), trace_ids=trace_ids)
             
             if process.returncode == 0:
                 print("✓ Printed successfully")
                 return True
             else:
-                print(f"✗ Print failed: {stderr}")
+                print(f"✗ Print failed: {process.stderr.decode('utf-8', 'replace')}")
                 return False
                 
         except Exception as e:
@@ -76,27 +191,66 @@ Time: {timestamp}
 
 """
     
-    def on_connect(self, client, userdata, flags, rc):
+    def publish(self, topic, payload, content_type=None, retain=False):
+        """Publish through the topic-alias helper (plain publish on MQTT 3.1.1)"""
+        return self.aliases.publish(self.client, topic, payload, content_type=content_type, retain=retain)
+    
+    def on_connect(self, client, userdata, flags, rc, properties=None):
         """Callback for when client connects to MQTT broker"""
         if rc == 0:
             print("✓ Connected to MQTT broker")
+            self.connection += 1
+            self.aliases.reset(properties)
             
-            # Subscribe to topics
-            topics = [MESSAGE_TOPIC, ASCII_TOPIC, IMAGE_TOPIC, PRESENCE_TOPIC]
-            for topic in topics:
-                client.subscribe(topic)
-                print(f"✓ Subscribed to: {topic}")
+            # Subscribe to topics, unless the broker resumed our v5 session
+            if MQTT_V5 and flags.get('session present'):
+                print("✓ Resumed MQTT session (subscriptions kept)")
+            else:
+                topics = [MESSAGE_TOPIC, ASCII_TOPIC, IMAGE_TOPIC, PRESENCE_TOPIC, CLOCK_TOPIC]
+                if self.fleet:
+                    # Claims first so we know what the fleet already printed, then share the work
+                    topics = self.fleet.subscriptions + [
+                        self.fleet.shared(MESSAGE_TOPIC), self.fleet.shared(ASCII_TOPIC),
+                        self.fleet.shared(IMAGE_TOPIC), PRESENCE_TOPIC, CLOCK_TOPIC]
+                for topic in topics:
+                    client.subscribe(topic, qos=1)
+                    print(f"✓ Subscribed to: {topic}")
+            
+            if self.fleet:
+                self.publish(self.fleet.presence_topic, "online", retain=True)
             
             # Send presence and start heartbeat
-            client.publish(MY_PRESENCE_TOPIC, "online", retain=True)
+            self.publish(MY_PRESENCE_TOPIC, "online", content_type='presence', retain=True)
             self.start_heartbeat()
-            self.print_startup_message()
+            if not self.banner_printed:  # once per start, not on every reconnect
+                self.banner_printed = True
+                self.print_startup_message()
+            self.record_startup('connect_seconds', "connected")
             
         else:
             print(f"✗ Failed to connect to MQTT: {rc}")
     
+    def on_disconnect(self, client, userdata, rc, properties=None):
+        """Aliases die with the connection - publish full topics until the next CONNACK"""
+        self.aliases.reset()
+        if rc != 0 and self.active:
+            print(f"⚠ Lost the MQTT connection ({rc}), reconnecting...")
+    
     def on_message(self, client, userdata, msg):
-        """Handle incoming MQTT messages"""
+        """Handle incoming MQTT messages; print jobs are acknowledged once they've printed"""
+        connection = self.connection
+        
+        def ack():
+            # After a reconnect the broker redelivers the message instead
+            if self.connection == connection:
+                client.ack(msg.mid, msg.qos)
+        
+        if not self.handle_message(msg, ack):
+            ack()
+    
+    def handle_message(self, msg, ack):
+        """Dispatch one message; True if a queued print job now owns the ack"""
+        received = time.time()
         topic = msg.topic
         payload = msg.payload.decode('utf-8')
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -104,19 +258,39 @@ Time: {timestamp}
         if topic == PRESENCE_TOPIC:
             self.handle_presence(payload.strip())
             return  # Don't show presence messages in console
+        
+        if topic == CLOCK_TOPIC:
+            reply = self.clock.handle(payload)
+            if reply:
+                self.publish(FRIEND_CLOCK_TOPIC, reply, content_type='clock')
+            return
+        
+        if self.fleet and self.fleet.handle(topic, payload):
+            return  # fleet bookkeeping, not a print job
             
         # Only show non-presence messages in console
         print(f"\n[{timestamp}] Received on {topic.split('/')[-1]}")
         
         if topic == MESSAGE_TOPIC:
-            self.handle_text_message(payload, timestamp)
+            queued = self.handle_text_message(payload, timestamp, received, ack)
+            self.record_startup('first_message_seconds', "first message handled")
+            return queued
             
         elif topic == ASCII_TOPIC:
             print("📺 ASCII art received (terminal display only)")
             # ASCII is just for terminal - we'll get the real image separately
             
         elif topic == IMAGE_TOPIC:
-            self.handle_image_message(payload, timestamp)
+            queued = self.handle_image_message(payload, timestamp, received, ack)
+            self.record_startup('first_message_seconds', "first message handled")
+            return queued
+    
+    def record_startup(self, metric, label):
+        """Note the first time something happens after start (cold-start latency)"""
+        if metric in self.startup:
+            return
+        self.startup[metric] = round(time.time() - self.started_at, 3)
+        print(f"⏱ {label} {self.startup[metric]:.2f}s after start")
     
     def handle_presence(self, status):
         """Handle friend's presence updates (silently)"""
@@ -124,8 +298,8 @@ Time: {timestamp}
         self.is_online = (status == 'online')
         # No console output, no printing - just track status silently
     
-    def handle_text_message(self, payload, timestamp):
-        """Handle text messages"""
+    def handle_text_message(self, payload, timestamp, received=None, ack=None):
+        """Handle text messages; True if queued (the job acks the message when done)"""
         try:
             data = json.loads(payload)
             sender = data.get('from', 'Unknown')
@@ -134,14 +308,30 @@ Time: {timestamp}
             
             print(f"💬 Message from {sender}: {text}")
             
+            job_id = job_id_for(data, payload)
+            delivery = self.accept(job_id)
+            if delivery is None:
+                return
+            trace_id = self.trace_received(data, received)
+            trace_ids = (trace_id,) if trace_id else ()
+            
+            if TEXT_RENDERER == 'layout':
+                # Admitted messages join the text batch that is still waiting to print
+                return self.queue_job(PRIORITY_TEXT, sender, TEXT_COST, self.print_text_batch,
+                                      cost=len(text), description=f"text from {sender}",
+                                      batch_item=(sender, text, msg_time, job_id, trace_id),
+                                      ack=ack, job_id=job_id, delivery=delivery)
             formatted_msg = self.format_text_message(sender, text, msg_time)
-            self.print_to_hp(formatted_msg)
+            action = lambda: self.print_owned(job_id, lambda: self.print_to_hp(formatted_msg, trace_ids))
+            return self.queue_job(PRIORITY_TEXT, sender, TEXT_COST, action,
+                                  cost=len(text), description=f"text from {sender}",
+                                  ack=ack, job_id=job_id, delivery=delivery)
             
         except json.JSONDecodeError:
             print(f"✗ Invalid message format: {payload}")
     
-    def handle_image_message(self, payload, timestamp):
-        """Handle actual image files - create combined image with text header"""
+    def handle_image_message(self, payload, timestamp, received=None, ack=None):
+        """Handle actual image files - queue them for the printer (True if queued)"""
         try:
             data = json.loads(payload)
             sender = data.get('from', 'Unknown')
@@ -151,43 +341,273 @@ Time: {timestamp}
             
             print(f"🖼️ High-res image from {sender}: {filename}")
             
-            # Decode base64 image
-            image_bytes = base64.b64decode(image_data)
+            job_id = job_id_for(data, payload)
+            delivery = self.accept(job_id)
+            if delivery is None:
+                return
+            trace_id = self.trace_received(data, received)
             
-            # Save original image to temp file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-                temp_file.write(image_bytes)
-                original_path = temp_file.name
+            return self.queue_job(PRIORITY_IMAGE, sender, IMAGE_COST,
+                                  lambda: self.print_owned(job_id, lambda: self.print_image(sender, image_data, filename, msg_time, trace_id)),
+                                  cost=len(image_data), description=f"image from {sender}",
+                                  ack=ack, job_id=job_id, delivery=delivery)
             
-            # Create combined image with text header + photo
-            combined_path = self.create_combined_image(sender, original_path, filename, msg_time)
+        except json.JSONDecodeError:
+            print(f"✗ Invalid image format")
+    
+    def print_text_batch(self, batch):
+        """Lay out a batch of admitted text messages on packed PDF pages and print them as one job"""
+        batch = [entry for entry in batch if self.owns(entry[3])]
+        if not batch:
+            return True  # the fleet printed all of them elsewhere
+        
+        messages = [(sender, text, msg_time) for sender, text, msg_time, _, _ in batch]
+        pdf, pages = render_messages(messages)
+        try:
+            process = self.lp(data=pdf, trace_ids=[entry[4] for entry in batch if entry[4]])
+        except Exception as e:
+            print(f"✗ Print error: {e}")
+            return False
+        
+        if process.returncode == 0:
+            print(f"✓ Printed {len(messages)} message(s) on {pages} page(s)")
+            if self.fleet:
+                for entry in batch:
+                    self.fleet.printed(entry[3])
+            return True
+        print(f"✗ Print failed: {process.stderr.decode('utf-8', 'replace')}")
+        return False
+    
+    def accept(self, job_id):
+        """Take a job in unless it's a redelivered copy (or the fleet has it); returns its delivery token"""
+        delivery = self.seen.add(job_id)
+        if delivery is None:
+            print(f"↷ Skipping {job_id}: already queued or printed")
+            return None
+        if self.fleet and not self.fleet.claim(job_id):
+            print(f"↷ Skipping {job_id}: already handled by the fleet")
+            self.seen.finished(job_id)
+            return None
+        return delivery
+    
+    def owns(self, job_id):
+        """True if this instance should print the job (always, outside fleet mode)"""
+        if not self.fleet:
+            return True
+        if self.fleet.won(job_id):
+            return True
+        print(f"↷ Skipping {job_id}: another instance claimed it first")
+        return False
+    
+    def print_owned(self, job_id, action):
+        """Run a print action if we own the job; tell the fleet once it has printed.
+
+        Returns False only if printing failed (so the scheduler retries it).
+        """
+        if not self.owns(job_id):
+            return True  # nothing to retry - another instance has it
+        result = action()
+        if self.fleet and result is not False:
+            self.fleet.printed(job_id)
+        return result
+    
+    def queue_job(self, priority, sender, tokens, action, cost, description, batch_item=None,
+                  ack=None, job_id=None, delivery=None):
+        """Pass a job through the sender's token bucket into the print queue.
+
+        With a batch_item the job is added to the waiting batch (action(items)
+        prints it) only once admission lets it through. ack runs when the job
+        is done; returns False if the job was rejected (the caller acks then).
+        A deferred job whose delivery was dropped on /stop is skipped when its
+        tokens arrive.
+        """
+        def done():
+            if job_id is not None:
+                self.seen.finished(job_id)
+            if ack:
+                ack()
+        
+        def submit():
+            if delivery is not None and not self.seen.current(job_id, delivery):
+                return
+            if batch_item is not None:
+                self.scheduler.submit_batched(priority, sender, batch_item, action,
+                                              cost=cost, description=description, on_done=done)
+            else:
+                self.scheduler.submit(priority, sender, action, cost=cost, description=description,
+                                      on_done=done)
+        
+        decision, wait = self.admission.admit(sender, tokens, submit)
+        if decision == DEFER:
+            print(f"⏳ {description} deferred {wait:.0f}s (sender over rate limit)")
+            self.publish_status()
+        elif decision != ADMIT:
+            print(f"✗ {description} rejected (sender over rate limit)")
+            self.publish_status()
+            if job_id is not None:
+                self.seen.finished(job_id)
+            return False
+        return True
+    
+    def check_printer_state(self):
+        """Ask CUPS whether the printer is idle, printing or stopped"""
+        try:
+            result = subprocess.run(['lpstat', '-p', self.printer_name],
+                                    capture_output=True, text=True, timeout=5)
+        except Exception:
+            return 'unknown'
+        output = result.stdout.lower()
+        if result.returncode != 0:
+            return 'unknown'
+        if 'disabled' in output:
+            return 'stopped'
+        if 'printing' in output:
+            return 'printing'
+        return 'idle'
+    
+    def check_cups_queue(self):
+        """Number of jobs CUPS still holds for our printer (0 in dry-run mode)"""
+        if self.dry_run is not None:
+            return 0
+        try:
+            result = subprocess.run(['lpstat', '-o', self.printer_name],
+                                    capture_output=True, text=True, timeout=5)
+        except Exception:
+            return 0
+        return sum(1 for line in result.stdout.splitlines() if line.strip())
+    
+    def publish_status(self):
+        """Publish queue depth, printer state and drain estimate (retained)"""
+        state = self.printer_state
+        if state == 'idle' and self.scheduler.busy:
+            state = 'printing'
+        # Jobs in CUPS that aren't the one we're waiting on (other users, other tools)
+        cups_extra = max(self.cups_jobs - (1 if self.scheduler.busy else 0), 0)
+        drain = self.scheduler.estimated_drain(extra_jobs=cups_extra)
+        status = {
+            'printer': state,
+            'queue_depth': self.scheduler.queue_depth() + cups_extra,
+            'deferred': self.admission.deferred_count(),
+            'drain_seconds': round(drain, 1),
+            'saturated': state == 'stopped' or drain > SATURATED_DRAIN,
+            'senders': self.admission.snapshot(),
+            'startup': self.startup,
+            'updated': time.time(),
+        }
+        self.publish(self.status_topic, json.dumps(status), content_type='status', retain=True)
+    
+    def print_image(self, sender, image_data, filename, msg_time, trace_id=None):
+        """Print one image job - create combined image with text header.
+
+        Returns False if the printer failed; an image that can't be decoded
+        or rendered is dropped rather than retried.
+        """
+        try:
+            # Decode base64 image and keep the original in the archive
+            image_bytes = base64.b64decode(image_data)
+            image_id = self.archive.add_original(image_bytes, sender, msg_time, filename)
             
-            if combined_path:  # Only print if image creation succeeded
-                # Print the combined image as one job
-                process = subprocess.run([
-                    'lp', '-d', PRINTER_NAME, 
-                    '-o', 'fit-to-page',
-                    combined_path
-                ], capture_output=True, text=True)
-                
-                if process.returncode == 0:
-                    print("✓ Combined image printed successfully")
-                else:
-                    print(f"✗ Image print failed: {process.stderr}")
-                
-                # Clean up combined image
-                if os.path.exists(combined_path):
-                    os.unlink(combined_path)
+            # Create combined image with text header + photo (reused if already rendered)
+            combined_path = self.render_composite(image_id, sender, filename, msg_time)
+            if trace_id:
+                self.traces.record(trace_id, 'composite')
             
-            # Clean up original image
-            if os.path.exists(original_path):
-                os.unlink(original_path)
+            if combined_path:  # Only print if image creation succeeded
+                printed = self.print_image_file(combined_path, (trace_id,) if trace_id else ())
+                print(f"🗂️  Archived as {image_id} - reprint with /reprint {image_id}")
+                return printed
                 
         except Exception as e:
             print(f"✗ Failed to handle image: {e}")
     
+    def render_composite(self, image_id, sender, filename, timestamp):
+        """Return the archived composite for an image, rendering it if needed"""
+        combined_path = self.archive.composite_path(image_id)
+        if combined_path:
+            return combined_path
+        
+        original_path = self.archive.original_path(image_id)
+        if not original_path:
+            return None
+        
+        composite = self.create_combined_image(sender, original_path, filename, timestamp)
+        if composite is None:
+            return None
+        return self.archive.add_composite(image_id, composite)
+    
+    def print_image_file(self, image_path, trace_ids=()):
+        """Send an image file to the printer as one job"""
+        process = self.lp('-o', 'fit-to-page', image_path, trace_ids=trace_ids)
+        
+        if process.returncode == 0:
+            print("✓ Combined image printed successfully")
+            return True
+        else:
+            print(f"✗ Image print failed: {process.stderr.decode('utf-8', 'replace')}")
+            return False
+    
+    def reprint(self, image_id):
+        """Reprint an archived image locally - no network transfer"""
+        key, entry = self.archive.get(image_id)
+        if entry is None:
+            print(f"✗ No archived image matching {image_id}")
+            return
+        
+        def job():
+            combined_path = self.render_composite(key, entry['sender'], entry['filename'], entry['time'])
+            if combined_path:
+                self.print_image_file(combined_path)
+            else:
+                print(f"✗ Archived image {key} is missing from disk")
+        
+        if self.scheduler.submit(PRIORITY_IMAGE, MY_NAME, job, cost=entry['size'],
+                                 description=f"reprint {key}") is None:
+            print("✗ Printer portal is offline - /start it first")
+            return
+        print(f"🔁 Reprinting {key} from {entry['sender']} ({entry['time']})")
+    
+    def list_archive(self):
+        """Show recently archived images"""
+        entries = self.archive.recent()
+        if not entries:
+            print("🗂️  Archive is empty")
+            return
+        print("🗂️  Recent images:")
+        for key, entry in entries:
+            print(f"  {key}  {entry['time']}  from {entry['sender']}  ({entry['size'] // 1024} KB)")
+    
+    def start_command_reader(self):
+        """Read local commands (/reprint <id>, /archive, /start, /stop) from stdin"""
+        def read_commands():
+            for line in sys.stdin:
+                parts = line.strip().split()
+                if not parts:
+                    continue
+                command = parts[0].lstrip('/').lower()
+                if command == 'reprint' and len(parts) == 2:
+                    self.reprint(parts[1].lower())
+                elif command == 'archive':
+                    self.list_archive()
+                elif command == 'start':
+                    if self.active:
+                        print("✗ Printer portal is already online")
+                    else:
+                        self.started_at = time.time()
+                        self.startup = {}
+                        self.banner_printed = False
+                        self.start_requested.set()
+                elif command == 'stop':
+                    if self.active:
+                        self.go_offline()
+                else:
+                    print(f"✗ Unknown command: {line.strip()}")
+        
+        reader = threading.Thread(target=read_commands, daemon=True)
+        reader.start()
+    
     def create_combined_image(self, sender, image_path, filename, timestamp):
         """Create one image with text header + photo"""
+        from PIL import Image, ImageDraw, ImageFont  # only loaded once a photo arrives
         try:
             # Open the original image
             photo = Image.open(image_path)
@@ -232,11 +652,11 @@ Time: {timestamp}
             photo_x = (combined_width - photo.width) // 2  # center the photo
             combined.paste(photo, (photo_x, header_height))
             
-            # Save combined image
-            combined_path = tempfile.mktemp(suffix='.jpg')
-            combined.save(combined_path, 'JPEG', quality=85)
+            # Encode combined image
+            buffer = io.BytesIO()
+            combined.save(buffer, 'JPEG', quality=85)
             
-            return combined_path
+            return buffer.getvalue()
             
         except Exception as e:
             print(f"✗ Error creating combined image: {e}")
@@ -270,8 +690,8 @@ File: {filename}
 (echo '{header_text}'; 
  echo '[IMAGE PRINTED BELOW]'; 
  echo; 
- lp -d {PRINTER_NAME} -o fit-to-page '{image_path}' > /dev/null 2>&1; 
- echo '{footer_text}') | lp -d {PRINTER_NAME}
+ lp -d {self.printer_name} -o fit-to-page '{image_path}' > /dev/null 2>&1; 
+ echo '{footer_text}') | lp -d {self.printer_name}
 """
             
             # Actually, let's try a simpler approach - just send text before image
@@ -289,7 +709,7 @@ Time: {timestamp}
             
             # Print image immediately after
             process = subprocess.run([
-                'lp', '-d', PRINTER_NAME, 
+                'lp', '-d', self.printer_name, 
                 '-o', 'fit-to-page',
                 image_path
             ], capture_output=True, text=True)
@@ -311,46 +731,128 @@ Time: {timestamp}
 Device: {MY_NAME}
 Listening for: {FRIEND_NAME}
 Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-Printer: {PRINTER_NAME}
+Printer: {self.printer_name}
 
 Ready to receive messages and images!
 {'='*50}
 
 """
-        self.print_to_hp(startup_msg)
+        self.scheduler.submit(PRIORITY_BANNER, MY_NAME, lambda: self.print_to_hp(startup_msg),
+                              cost=len(startup_msg), description="startup banner")
     
     def start_heartbeat(self):
-        """Start sending heartbeat presence"""
+        """Start sending heartbeat presence and clock pings (once - reconnects reuse the running timer)"""
+        if self.heartbeat_running:
+            return
+        self.heartbeat_running = True
+        
         def send_heartbeat():
-            self.client.publish(MY_PRESENCE_TOPIC, "online", retain=True)
+            if self.active:  # stays quiet while stopped in standby
+                self.publish(MY_PRESENCE_TOPIC, "online", content_type='presence', retain=True)
+                self.publish(FRIEND_CLOCK_TOPIC, self.clock.ping(), content_type='clock')
+                self.printer_state = self.check_printer_state()
+                self.cups_jobs = self.check_cups_queue()
+                self.publish_status()
             timer = threading.Timer(HEARTBEAT_INTERVAL, send_heartbeat)
             timer.daemon = True
             timer.start()
         
         send_heartbeat()
     
-    def run(self):
-        """Start the printer portal"""
+    def connect(self):
+        """Connect to the broker (the network loop runs in run())"""
+        print(f"🏠 Connecting to {self.broker}...")
+        self.active = True
+        if MQTT_V5:
+            self.client.connect(self.broker, 1883, 60, clean_start=False,
+                                properties=connect_properties(RECEIVE_MAXIMUM))
+        else:
+            self.client.connect(self.broker, 1883, 60)
+    
+    def go_offline(self):
+        """Drop the print queue, announce that we're offline and disconnect (ends the network loop).
+
+        The session ends with the connection, so the broker doesn't keep what
+        is sent while the printer is off for the next /start (the sender says
+        the photo only shows as ASCII). Sessions are only resumed after
+        unexpected drops.
+        """
+        self.active = False
+        dropped = self.scheduler.pause()
+        if dropped:
+            print(f"💤 Dropped {len(dropped)} queued job(s) - they won't print"
+                  + (" here (the broker can hand them to another instance)" if self.fleet else ""))
+        if not self.scheduler.wait_idle(STOP_WAIT):
+            print(f"⚠ The job on the printer hasn't finished after {STOP_WAIT}s, disconnecting anyway")
+        self.seen.forget_unfinished()
+        if self.fleet:
+            self.fleet.release_unprinted()
+        self.publish(self.status_topic, json.dumps({'printer': 'offline', 'updated': time.time()}), retain=True)
+        if self.fleet:
+            # Other instances stay up, so only this instance goes offline
+            self.publish(self.fleet.presence_topic, "offline", retain=True)
+        else:
+            self.publish(MY_PRESENCE_TOPIC, "offline", retain=True)
+        if MQTT_V5:
+            self.client.disconnect(properties=disconnect_properties())
+        else:
+            self.client.disconnect()  # 3.1.1 portals use clean sessions
+    
+    def run(self, standby=False):
+        """Start the printer portal (in standby, wait for /start on stdin first)"""
         try:
-            print(f"🏠 Connecting to {BROKER}...")
-            self.client.connect(BROKER, 1883, 60)
-            
-            print("🖨️  NYC Printer Portal started!")
-            print(f"📍 Device: {MY_NAME}")
-            print(f"👤 Listening for: {FRIEND_NAME}")
-            print(f"🖨️  Printer: {PRINTER_NAME}")
-            print("\nPress Ctrl+C to stop...")
-            
-            self.client.loop_forever()
+            self.scheduler.start()
+            self.start_command_reader()
+            if standby:
+                from PIL import Image, ImageDraw, ImageFont  # noqa: F401 - nothing to wait for yet, warm the photo path
+            while True:
+                if standby:
+                    self.scheduler.pause()  # nothing prints (not even /reprint) until /start
+                    print("💤 Printer portal on standby - /start to go online")
+                    self.start_requested.wait()
+                    self.start_requested.clear()
+                self.scheduler.resume()
+                self.connect()
+                
+                print("🖨️  NYC Printer Portal started!")
+                print(f"📍 Device: {MY_NAME}")
+                print(f"👤 Listening for: {FRIEND_NAME}")
+                print(f"🖨️  Printer: {self.printer_name}")
+                if self.fleet:
+                    print(f"🚚 Fleet: {self.fleet.group} (instance {self.instance})")
+                print("\nPress Ctrl+C to stop...")
+                
+                self.client.loop_forever()  # returns after /stop
+                if not standby:
+                    break
             
         except KeyboardInterrupt:
             print("\nShutting down printer portal...")
-            self.client.publish(MY_PRESENCE_TOPIC, "offline", retain=True)
-            self.client.disconnect()
+            if self.active:
+                self.go_offline()
             
         except Exception as e:
             print(f"✗ Error: {e}")
+            return
+        
+        print(f"📊 Print queue wait times:\n{self.scheduler.format_stats()}")
+        self.scheduler.stop(timeout=5)
 
 if __name__ == "__main__":
-    portal = PrinterPortal()
-    portal.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Print incoming messages and photos")
+    parser.add_argument('--fleet', metavar='GROUP', help="share the work with other portals in this group")
+    # Stable across restarts: the instance name is the MQTT session, and a new name per run
+    # would leave the old session in the shared group, queuing jobs nobody prints
+    parser.add_argument('--instance', default=os.uname().nodename,
+                        help="unique, stable name of this portal within the fleet (default: hostname)")
+    parser.add_argument('--broker', default=BROKER)
+    parser.add_argument('--printer', default=PRINTER_NAME)
+    parser.add_argument('--dry-run', type=float, metavar='SECONDS',
+                        help="don't print, just wait this long per job (for benchmarks)")
+    parser.add_argument('--standby', action='store_true',
+                        help="load everything, then wait for /start on stdin (resident mode for the chat)")
+    args = parser.parse_args()
+    
+    portal = PrinterPortal(broker=args.broker, printer=args.printer, fleet_group=args.fleet,
+                           instance=args.instance, dry_run=args.dry_run)
+    portal.run(standby=args.standby)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""Priority and fairness aware print scheduler shared by both printer portals.
+
+Jobs are grouped into priority classes (text before images, startup banner
+last) and, inside a class, senders share the printer by weighted fair queuing.
+Waiting jobs age towards the front so nothing starves behind a busy sender.
+"""
+import itertools
+import math
+import threading
+import time
+
+# Priority classes - lower number prints first
+PRIORITY_TEXT = 0
+PRIORITY_IMAGE = 1
+PRIORITY_BANNER = 2
+
+CLASS_NAMES = {
+    PRIORITY_TEXT: 'text',
+    PRIORITY_IMAGE: 'image',
+    PRIORITY_BANNER: 'banner',
+}
+
+AGING_INTERVAL = 30  # seconds of waiting that promote a job by one class
+DEFAULT_WEIGHT = 1.0
+WAIT_SAMPLES = 200  # wait times kept per class for stats
+DEFAULT_DURATION = {PRIORITY_TEXT: 5.0, PRIORITY_IMAGE: 30.0, PRIORITY_BANNER: 5.0}  # seconds
+DURATION_SMOOTHING = 0.3  # weight of the newest sample in the print time average
+MAX_ATTEMPTS = 3  # tries per job before giving up on it
+RETRY_DELAY = 10  # seconds before a failed job goes back into the queue
+
+
+class PrintJob:
+    def __init__(self, seq, priority, sender, cost, action, description):
+        self.seq = seq
+        self.priority = priority
+        self.sender = sender
+        self.cost = cost
+        self.action = action
+        self.description = description
+        self.submitted = time.monotonic()
+        self.start_tag = 0.0
+        self.finish_tag = 0.0
+        self.items = None  # batched jobs: the items printed together
+        self.item_submitted = []  # batched jobs: when each item was queued
+        self.done = []  # callbacks run once the job has finished
+        self.attempts = 0
+
+    def effective_priority(self, now):
+        """Class priority minus the promotion earned by waiting"""
+        return self.priority - (now - self.submitted) / AGING_INTERVAL
+
+
+class PrintScheduler:
+    def __init__(self, weights=None, on_change=None):
+        self.weights = dict(weights or {})
+        self.on_change = on_change  # called after a job is queued or finished
+        self.durations = dict(DEFAULT_DURATION)  # priority class -> avg print seconds
+        self.pending = []
+        self.virtual_time = {}  # priority class -> virtual clock
+        self.last_finish = {}  # (priority class, sender) -> last virtual finish tag
+        self.batches = {}  # priority class -> batch job still waiting to print
+        self.waits = {name: [] for name in CLASS_NAMES.values()}
+        self.printed = {name: 0 for name in CLASS_NAMES.values()}
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.running = False
+        self.paused = False  # offline: nothing is queued or started
+        self.busy = False
+        self.busy_since = 0.0
+        self.busy_priority = None
+        self.worker = None
+
+    def start(self):
+        """Start the worker thread that feeds the printer backend"""
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def stop(self, timeout=None):
+        """Stop the worker once the current job finishes"""
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.worker:
+            self.worker.join(timeout)
+
+    def pause(self):
+        """Stop starting jobs and drop the queue; returns the dropped jobs.
+
+        Jobs submitted (or due for a retry) while paused are dropped too. Their
+        on_done callbacks never run, so their messages stay unacknowledged.
+        """
+        with self.cond:
+            self.paused = True
+            dropped, self.pending = self.pending, []
+            self.batches = {}
+        self._changed()
+        return dropped
+
+    def resume(self):
+        with self.cond:
+            self.paused = False
+            self.cond.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """Wait for the job being printed, if any; False on timeout"""
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.busy, timeout)
+
+    def set_weight(self, sender, weight):
+        with self.cond:
+            self.weights[sender] = weight
+
+    def _queue(self, priority, sender, action, cost, description):
+        job = PrintJob(next(self.counter), priority, sender, max(cost, 1), action, description)
+        job.start_tag, job.finish_tag = self._charge(priority, sender, job.cost)
+        self.pending.append(job)
+        self.cond.notify()
+        return job
+
+    def _charge(self, priority, sender, cost):
+        """Fair-queue tags for cost printed on sender's behalf: (start, finish)"""
+        # Weighted fair queuing per class: a sender's jobs are spaced by cost / weight
+        weight = self.weights.get(sender, DEFAULT_WEIGHT)
+        key = (priority, sender)
+        start = max(self.virtual_time.get(priority, 0.0), self.last_finish.get(key, 0.0))
+        self.last_finish[key] = start + max(cost, 1) / weight
+        return start, self.last_finish[key]
+
+    def submit(self, priority, sender, action, cost=1, description='', on_done=None):
+        """Queue a print job; action is a no-argument callable that prints it.
+
+        An action that returns False (or raises) is retried up to MAX_ATTEMPTS
+        times. on_done is called after the last attempt (e.g. to acknowledge
+        the message the job came from).
+        """
+        with self.cond:
+            if self.paused:
+                return None
+            job = self._queue(priority, sender, action, cost, description)
+            if on_done:
+                job.done.append(on_done)
+        self._changed()
+        return job
+
+    def submit_batched(self, priority, sender, item, action, cost=1, description='', on_done=None):
+        """Add item to the class's waiting batch job, or queue a new batch for it.
+
+        action(items) prints a whole batch; once the worker has picked a batch,
+        new items start the next one. on_done runs when the item's batch is done.
+        Each item is charged to its own sender and waits are recorded per item.
+        """
+        with self.cond:
+            if self.paused:
+                return None
+            job = self.batches.get(priority)
+            if job is None:
+                items = []
+                job = self._queue(priority, sender, lambda: action(items), cost, description)
+                job.items = items
+                self.batches[priority] = job
+            else:
+                self._charge(priority, sender, cost)
+                job.cost += max(cost, 1)
+            job.items.append(item)
+            job.item_submitted.append(time.monotonic())
+            if on_done:
+                job.done.append(on_done)
+            if len(job.items) > 1:
+                return job
+        self._changed()
+        return job
+
+    def _changed(self):
+        if self.on_change:
+            try:
+                self.on_change()
+            except Exception as e:
+                print(f"✗ Queue status update failed: {e}")
+
+    def queue_depth(self):
+        with self.cond:
+            return len(self.pending) + (1 if self.busy else 0)
+
+    def estimated_drain(self, extra_jobs=0):
+        """Seconds until everything queued now has printed.
+
+        extra_jobs are jobs we don't know the class of (e.g. already in CUPS's
+        queue); they are counted as images, the slowest class we print.
+        """
+        with self.cond:
+            total = sum(self.durations.get(j.priority, 0.0) for j in self.pending)
+            total += extra_jobs * self.durations.get(PRIORITY_IMAGE, 0.0)
+            if self.busy:
+                elapsed = time.monotonic() - self.busy_since
+                total += max(self.durations.get(self.busy_priority, 0.0) - elapsed, 0.0)
+            return total
+
+    def _pick(self):
+        """Choose the next job: aged class first, then fair-queue tag within a class.
+
+        Fair-queue tags are only comparable inside one class (each has its own
+        virtual clock), so when an aged job ties with another class, the head
+        that has waited longest goes first.
+        """
+        now = time.monotonic()
+        level = min(math.ceil(j.effective_priority(now)) for j in self.pending)
+        heads = {}
+        for j in self.pending:
+            if math.ceil(j.effective_priority(now)) != level:
+                continue
+            head = heads.get(j.priority)
+            if head is None or (j.finish_tag, j.seq) < (head.finish_tag, head.seq):
+                heads[j.priority] = j
+        job = min(heads.values(), key=lambda j: (j.submitted, j.seq))
+        self.pending.remove(job)
+        if self.batches.get(job.priority) is job:
+            del self.batches[job.priority]  # closed: later items go into a new batch
+        self.virtual_time[job.priority] = max(self.virtual_time.get(job.priority, 0.0), job.start_tag)
+        return job
+
+    def _record_wait(self, job):
+        name = CLASS_NAMES.get(job.priority, str(job.priority))
+        samples = self.waits.setdefault(name, [])
+        now = time.monotonic()
+        submitted = job.item_submitted or [job.submitted]  # one sample per batched item
+        samples.extend(now - t for t in submitted)
+        del samples[:-WAIT_SAMPLES]
+        self.printed[name] = self.printed.get(name, 0) + len(submitted)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and (self.paused or not self.pending):
+                    self.cond.wait()
+                if not self.running:
+                    return
+                job = self._pick()
+                if not job.attempts:
+                    self._record_wait(job)
+                job.attempts += 1
+                self.busy = True
+                self.busy_since = time.monotonic()
+                self.busy_priority = job.priority
+            failed = True
+            try:
+                failed = job.action() is False
+            except Exception as e:
+                print(f"✗ Print job failed ({job.description}): {e}")
+            finally:
+                if failed and job.attempts < MAX_ATTEMPTS:
+                    print(f"↷ Retrying {job.description} in {RETRY_DELAY}s "
+                          f"(attempt {job.attempts + 1} of {MAX_ATTEMPTS})")
+                    retry = threading.Timer(RETRY_DELAY, self._requeue, (job,))
+                    retry.daemon = True
+                    retry.start()
+                else:
+                    if failed:
+                        print(f"✗ Giving up on {job.description} after {job.attempts} attempts")
+                    self._finish(job)
+                with self.cond:
+                    self.busy = False
+                    self.cond.notify_all()
+                    took = time.monotonic() - self.busy_since
+                    average = self.durations.get(job.priority, took)
+                    self.durations[job.priority] = (
+                        (1 - DURATION_SMOOTHING) * average + DURATION_SMOOTHING * took)
+                self._changed()
+
+    def _requeue(self, job):
+        """Put a failed job back in the queue (it keeps its place in the fair order)"""
+        with self.cond:
+            if self.paused:
+                return
+            self.pending.append(job)
+            self.cond.notify()
+        self._changed()
+
+    def _finish(self, job):
+        """Run the job's completion callbacks after its last attempt"""
+        for callback in job.done:
+            try:
+                callback()
+            except Exception as e:
+                print(f"✗ Job completion callback failed ({job.description}): {e}")
+
+    def wait_stats(self):
+        """Per-class wait times in seconds: count, mean, p95 and max"""
+        with self.cond:
+            stats = {}
+            for name, samples in self.waits.items():
+                if not samples:
+                    stats[name] = {'printed': self.printed.get(name, 0), 'mean': 0.0,
+                                   'p95': 0.0, 'max': 0.0}
+                    continue
+                ordered = sorted(samples)
+                stats[name] = {
+                    'printed': self.printed.get(name, 0),
+                    'mean': sum(ordered) / len(ordered),
+                    'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    'max': ordered[-1],
+                }
+            return stats
+
+    def format_stats(self):
+        lines = []
+        for name, s in self.wait_stats().items():
+            lines.append(f"  {name:<6} printed={s['printed']:<4} wait mean={s['mean']:.1f}s "
+                         f"p95={s['p95']:.1f}s max={s['max']:.1f}s")
+        return "\n".join(lines)
@@ -1,25 +1,49 @@
 import os
 os.environ['OPENCV_LOG_LEVEL'] = 'ERROR'  # Suppress OpenCV warnings
-import cv2
-from PIL import Image
-import numpy as np
 from datetime import datetime
-import paho.mqtt.publish as publish
+import threading
+import time
 import sys
 import base64
+import contextlib
+import importlib
+import io
 import json
+import uuid
+from capture_store import CaptureStore
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # shared modules in the repo root
+from tracing import TraceLog, new_trace, stamp
 
 # ========= CONFIG =========
 BROKER = "test.mosquitto.org"
 SIZE = (80, 40)  # slightly bigger? lol
 CAPTURE_DIR = "captures"
+SAVE_CAPTURES = True  # archive each JPEG + ASCII to CAPTURE_DIR (batched, in the background, size-bounded)
+JPEG_QUALITY = 95
 ASCII_CHARS = "█▓▒@%#*+=-:. "
+STATUS_WAIT = 2  # seconds to wait for the receiver's retained status
+MAX_BACKOFF = 20  # seconds to hold a photo while the receiver's queue is saturated
+BACKOFF_STEP = 5
+IMAGE_COST = 5  # tokens the receiver charges for an image
+MQTT_V5 = True  # message expiry so stale photos don't print hours later (False = MQTT 3.1.1)
+ASCII_EXPIRY = 15 * 60  # seconds
+IMAGE_EXPIRY = 15 * 60
 
-os.makedirs(CAPTURE_DIR, exist_ok=True)
+HEAVY_MODULES = ('cv2', 'numpy')  # imported in the background while we check on the receiver
 
 # ========= FUNCTIONS =========
 
+def preload(modules=HEAVY_MODULES):
+    """Start importing heavy modules in a background thread; later imports just wait for it"""
+    def load():
+        for name in modules:
+            importlib.import_module(name)
+    loader = threading.Thread(target=load, daemon=True)
+    loader.start()
+    return loader
+
 def capture_image():
+    import cv2
     print("attempting to access camera...", flush=True)
     
     # try to use the default camera first
@@ -61,111 +85,269 @@ def capture_image():
     start_y = (height - side) // 2
     square_frame = frame[start_y:start_y+side, start_x:start_x+side]
 
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    image_path = os.path.join(CAPTURE_DIR, f'webcam_{timestamp}.jpg')
-    cv2.imwrite(image_path, square_frame)
-    return True, image_path
+    # the frame stays in memory - nothing touches the SD card before publishing
+    return True, square_frame
 
-def image_to_ascii(image_path, size=SIZE):
-    img = Image.open(image_path).convert('L')
-    img = img.resize(size)
+def frame_to_ascii(frame, size=SIZE):
+    """ASCII art straight from the captured frame (grayscale downscale, no file round trip)"""
+    import cv2
+    import numpy as np
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    pixels = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
 
     # Enhanced brightness normalization
-    pixels = np.asarray(img)
     # Apply gamma correction to brighten dark areas
     gamma = 1.5
     pixels = np.power(pixels / 255.0, 1/gamma) * 255.0
     # Normalize to full range
     pixels = (pixels - pixels.min()) / (np.ptp(pixels) + 1e-5)
     pixels = (pixels * 255).astype(np.uint32)
-    img = Image.fromarray(pixels)
-    ascii_img = ""
-    for row in np.array(img):
-        for pixel in row:
-            ascii_img += ASCII_CHARS[pixel * len(ASCII_CHARS) // 256]
-        ascii_img += "\n"
 
-    return ascii_img
+    chars = np.array(list(ASCII_CHARS))
+    rows = chars[pixels * len(ASCII_CHARS) // 256]
+    return "".join("".join(row) + "\n" for row in rows)
+
+def encode_jpeg(frame):
+    """Encode the frame once; the same bytes are published and archived"""
+    import cv2
+    ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise RuntimeError("JPEG encoding failed")
+    return buffer.tobytes()
+
+# ========= mqtt =========
+
+def new_client():
+    import paho.mqtt.client as mqtt
+    return mqtt.Client(protocol=mqtt.MQTTv5 if MQTT_V5 else mqtt.MQTTv311)
+
+def publish_messages(messages):
+    """Publish (topic, payload, expiry seconds) tuples at QoS 1 over one connection.
+
+    Returns the time each one was acknowledged by the broker.
+    """
+    from paho.mqtt.packettypes import PacketTypes
+    from paho.mqtt.properties import Properties
+    client = new_client()
+    client.connect(BROKER, 1883, 60)
+    client.loop_start()
+    acked = []
+    try:
+        for topic, payload, expiry in messages:
+            props = None
+            if MQTT_V5:
+                props = Properties(PacketTypes.PUBLISH)
+                props.MessageExpiryInterval = expiry
+            client.publish(topic, payload, qos=1, retain=False, properties=props).wait_for_publish()
+            acked.append(time.time())
+    finally:
+        client.disconnect()
+        client.loop_stop()
+    return acked
+
+# ========= receiver backpressure =========
 
-# ========= base64 decode =========
+def combine_statuses(statuses):
+    """Merge the statuses of a portal fleet into one view of the receiver"""
+    live = [s for s in statuses if s.get('printer') != 'offline']
+    if not live:
+        return {'printer': 'offline'} if statuses else None
+    senders = {}
+    for s in live:
+        for name, bucket in s.get('senders', {}).items():
+            # Each portal keeps its own bucket; the emptiest one is the one to worry about
+            if name not in senders or bucket.get('tokens', 0) < senders[name].get('tokens', 0):
+                senders[name] = bucket
+    return {
+        'printer': 'printing' if any(s.get('printer') == 'printing' for s in live) else live[0].get('printer'),
+        'queue_depth': sum(s.get('queue_depth', 0) for s in live),
+        'drain_seconds': min(s.get('drain_seconds', 0) for s in live),
+        'saturated': all(s.get('saturated') for s in live),
+        'senders': senders,
+    }
+
+def get_receiver_status(recipient):
+    """Read the receiver's retained status from status/<recipient> (and fleet instances); None if unknown"""
+    statuses = {}
+    received = threading.Event()
+
+    def on_message(client, userdata, msg):
+        try:
+            statuses[msg.topic] = json.loads(msg.payload.decode('utf-8'))
+        except ValueError:
+            pass
+        received.set()
+
+    client = new_client()
+    client.on_message = on_message
+    try:
+        client.connect(BROKER, 1883, 60)
+        client.subscribe([(f"status/{recipient}", 0), (f"status/{recipient}/+", 0)])
+        client.loop_start()
+        if received.wait(STATUS_WAIT):
+            time.sleep(0.3)  # retained statuses from the rest of a fleet arrive right behind
+        client.loop_stop()
+        client.disconnect()
+    except Exception:
+        return None
+    return combine_statuses(list(statuses.values()))
 
-def image_to_base64(image_path):
-    """Convert image file to base64 string"""
-    with open(image_path, 'rb') as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-    return encoded_string
+def wait_for_receiver(sender, recipient, status=None):
+    """Back off while the receiver's print queue is saturated; warn about anything odd.
 
-def send_dual_image(sender, recipient, image_path):
+    The chat passes in the status it already follows (and holds /p itself while
+    the queue is saturated); only when we run on our own do we ask the broker.
+    """
+    if status is None:
+        waited = 0
+        status = get_receiver_status(recipient)
+        while status and status.get('saturated') and waited < MAX_BACKOFF:
+            print(f"⏳ {recipient}'s printer is busy ({status.get('queue_depth', '?')} queued, "
+                  f"~{status.get('drain_seconds', 0):.0f}s to drain), waiting...", file=sys.stderr)
+            time.sleep(BACKOFF_STEP)
+            waited += BACKOFF_STEP
+            status = get_receiver_status(recipient)
+
+    if not status or status.get('printer') == 'offline':
+        print(f"⚠ {recipient}'s printer is off - the photo will only show as ASCII", file=sys.stderr)
+    elif status.get('saturated'):
+        print(f"⚠ {recipient}'s print queue is still saturated, sending anyway", file=sys.stderr)
+    else:
+        tokens = status.get('senders', {}).get(sender, {}).get('tokens')
+        if tokens is not None and tokens < IMAGE_COST:
+            print(f"⚠ sending fast - {recipient}'s portal will delay this print", file=sys.stderr)
+    return status
+
+def send_dual_image(sender, recipient, frame, filename, trace):
     """Send both ASCII (for terminal) and base64 image (for printer)"""
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    timings = {}
     
     # Generate ASCII for terminal display
-    ascii_art = image_to_ascii(image_path)
+    started = time.perf_counter()
+    ascii_art = frame_to_ascii(frame)
+    timings['ascii'] = time.perf_counter() - started
     
-    # Convert image to base64 for printer
-    image_base64 = image_to_base64(image_path)
+    # Encode once, base64 for printer
+    started = time.perf_counter()
+    jpeg_bytes = encode_jpeg(frame)
+    image_base64 = base64.b64encode(jpeg_bytes).decode('utf-8')
+    timings['encode'] = time.perf_counter() - started
+    stamp(trace, 'encode')
     
     # Send ASCII version to terminal (existing topic)
     ascii_topic = f"ascii/{recipient}"
     ascii_payload = f"[ascii image from {sender} @ {timestamp}]\n{ascii_art}"
     
-    publish.single(
-        ascii_topic,
-        payload=ascii_payload,
-        hostname=BROKER,
-        qos=1,
-        retain=False
-    )
-    
     # Send actual image for printer (new topic)
     image_topic = f"images/{recipient}"
     image_payload = {
         "from": sender,
         "timestamp": timestamp,
-        "filename": os.path.basename(image_path),
+        "filename": filename,
         "type": "image",
+        "id": uuid.uuid4().hex,
+        "trace": stamp(trace, 'publish'),
         "data": image_base64
     }
     
-    publish.single(
-        image_topic,
-        payload=json.dumps(image_payload),
-        hostname=BROKER,
-        qos=1,
-        retain=False
-    )
+    started = time.perf_counter()
+    acked = publish_messages([
+        (ascii_topic, ascii_payload, ASCII_EXPIRY),
+        (image_topic, json.dumps(image_payload), IMAGE_EXPIRY),
+    ])
+    timings['publish'] = time.perf_counter() - started
+    timings['broker'] = acked[-1]  # PUBACK for the image: the broker has it
     
-    return ascii_art, len(image_base64)
+    return ascii_art, jpeg_bytes, len(image_base64), timings
 
 # ========= MAIN =========
 
-if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print("Usage: python3 ascii-cam-sender-enhanced.py <sender> <recipient>")
-        print("Example: python3 ascii-cam-sender-enhanced.py nyc-boshi shanghai-cedar")
-        sys.exit(1)
-
-    SENDER = sys.argv[1]
-    RECIPIENT = sys.argv[2]
+def capture_and_send(sender, recipient, store=None, status=None):
+    """Wait for the receiver, take a photo and send it; False if the camera failed"""
+    wait_for_receiver(sender, recipient, status)
 
     success, result = capture_image()
     if not success:
         print("❌", result)
-        exit()
+        return False
+    captured = time.perf_counter()
+    trace = stamp(new_trace(sender), 'capture')
 
-    ascii_art, base64_size = send_dual_image(SENDER, RECIPIENT, result)
+    image_name = f"webcam_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
+    ascii_art, jpeg_bytes, base64_size, timings = send_dual_image(sender, recipient, result, image_name, trace)
+    latency = time.perf_counter() - captured
+    traces = TraceLog(sender)
+    traces.record_trace(trace)
+    traces.record(trace['id'], 'broker', timings['broker'])
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-# Save locally
-    ascii_path = os.path.join(CAPTURE_DIR, f"ascii_{SENDER}_{timestamp.replace(' ', '_').replace(':','-')}.txt")
-    with open(ascii_path, 'w') as f:
-        f.write(f"[ascii image from {SENDER} @ {timestamp}]\n{ascii_art}")
+    # Save locally, in the background
+    ascii_path = None
+    if store:
+        ascii_name = f"ascii_{sender}_{timestamp.replace(' ', '_').replace(':','-')}.txt"
+        ascii_path = os.path.join(CAPTURE_DIR, ascii_name)
+        store.add(image_name, jpeg_bytes)
+        store.add(ascii_name, f"[ascii image from {sender} @ {timestamp}]\n{ascii_art}".encode('utf-8'))
 
     # Output ASCII art to console (for sender to see)
     print(ascii_art)  # Display ASCII in sender's console
     
     # Status messages to stderr so they don't interfere with ASCII display
     print(f"\n✓ Dual image sent:", file=sys.stderr)
-    print(f"  ASCII to: ascii/{RECIPIENT}", file=sys.stderr)
-    print(f"  Image to: images/{RECIPIENT} ({base64_size} bytes)", file=sys.stderr)
-    print(f"  Saved locally: {ascii_path}", file=sys.stderr)
\ No newline at end of file
+    print(f"  ASCII to: ascii/{recipient}", file=sys.stderr)
+    print(f"  Image to: images/{recipient} ({base64_size} bytes)", file=sys.stderr)
+    if ascii_path:
+        print(f"  Saved locally: {ascii_path}", file=sys.stderr)
+    print(f"⏱ capture→publish {latency * 1000:.0f} ms (ascii {timings['ascii'] * 1000:.0f}, "
+          f"encode {timings['encode'] * 1000:.0f}, publish {timings['publish'] * 1000:.0f}) "
+          f"trace {trace['id']}", file=sys.stderr)
+    return True
+
+def serve(sender, recipient, store=None):
+    """Resident mode: imports stay loaded, one capture per line on stdin.
+
+    A request line may carry the receiver's status as {"status": {...}}. Each
+    capture is answered with one JSON line on stdout:
+    {"ok": bool, "stdout": ascii art, "stderr": status lines}.
+    """
+    preload(HEAVY_MODULES + ('paho.mqtt.client',)).join()
+    print(json.dumps({'ready': True}), flush=True)
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            status = json.loads(line).get('status')
+        except (ValueError, AttributeError):
+            status = None
+        out, err = io.StringIO(), io.StringIO()
+        ok = False
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                ok = capture_and_send(sender, recipient, store, status)
+            except Exception as e:
+                print(f"❌ {e}", file=sys.stderr)
+        print(json.dumps({'ok': ok, 'stdout': out.getvalue(), 'stderr': err.getvalue()}), flush=True)
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--serve']
+    if len(args) != 2:
+        print("Usage: python3 ascii-cam-sender-enhanced.py [--serve] <sender> <recipient>")
+        print("Example: python3 ascii-cam-sender-enhanced.py nyc-boshi shanghai-cedar")
+        sys.exit(1)
+
+    SENDER, RECIPIENT = args
+    # A one-shot run only writes its captures; the resident sender does the packing
+    store = CaptureStore(CAPTURE_DIR, pack='--serve' in sys.argv) if SAVE_CAPTURES else None
+
+    if '--serve' in sys.argv:
+        serve(SENDER, RECIPIENT, store)
+    else:
+        preload()  # cv2/numpy load while we ask about the receiver's queue
+        # The chat hands over the receiver status it already has, saving a broker round trip
+        status = json.loads(os.environ['RECEIVER_STATUS']) if os.environ.get('RECEIVER_STATUS') else None
+        if not capture_and_send(SENDER, RECIPIENT, store, status):
+            exit()
+
+    if store:
+        store.close()  # let the background writes finish before exiting
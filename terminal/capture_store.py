@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""Bounded, rotating archive for the sender's captures.
+
+New captures land as loose files in CAPTURE_DIR. Once there are too many (or
+they get old) the older ones are packed into compressed zip segments under
+CAPTURE_DIR/segments, and an index maps every capture name to its segment so
+past photos can still be pulled out quickly. Whole segments are dropped,
+oldest first, to stay inside the size and age budget. Writes are queued and
+done in batches on a background thread, which also packs when the store is
+long-lived (the resident sender); one-shot senders only write and leave
+packing to the next resident run or `pack`.
+
+    python3 terminal/capture_store.py list [prefix]
+    python3 terminal/capture_store.py get <name> [output path]
+    python3 terminal/capture_store.py pack
+"""
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import zipfile
+
+CAPTURE_DIR = "captures"
+MAX_LOOSE = 40  # loose captures before the older ones get packed
+KEEP_LOOSE = 10  # newest captures that always stay loose
+LOOSE_AGE = 24 * 3600  # seconds before a loose capture gets packed regardless
+MAX_BYTES = 300 * 1024 * 1024  # total archive budget
+MAX_AGE = 180 * 24 * 3600  # seconds before a segment is dropped
+
+
+class CaptureStore:
+    def __init__(self, root=CAPTURE_DIR, pack=True):
+        self.root = root
+        self.pack = pack  # pack and rotate after writes (False: just write)
+        self.segments_dir = os.path.join(root, 'segments')
+        self.index_path = os.path.join(root, 'index.json')
+        self.lock = threading.Lock()  # index; never held while a segment is written
+        self.queue_lock = threading.Lock()  # pending writes and the writer thread
+        self.maintain_lock = threading.Lock()  # one packing pass at a time
+        self.pending = queue.Queue()
+        self.writer = None
+        os.makedirs(self.segments_dir, exist_ok=True)
+        self.index = self._load_index()
+
+    # ===== index =====
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {}
+        index.setdefault('segments', {})
+        index.setdefault('captures', {})
+        return index
+
+    def _save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    # ===== writes (batched, background) =====
+
+    def add(self, name, data):
+        """Queue a capture for writing; returns immediately"""
+        with self.queue_lock:
+            self.pending.put((name, data))
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_pending)  # finishes before exit
+                self.writer.start()
+
+    def _write_pending(self):
+        while True:
+            batch = []
+            try:
+                while True:
+                    batch.append(self.pending.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                with self.queue_lock:
+                    if self.pending.empty():
+                        self.writer = None
+                        break
+                continue
+            for name, data in batch:
+                try:
+                    with open(os.path.join(self.root, name), 'wb') as f:
+                        f.write(data)
+                except OSError as e:
+                    print(f"⚠ couldn't archive {name}: {e}", file=sys.stderr)
+            if not self.pack:
+                continue
+            try:
+                self.maintain()
+            except OSError as e:
+                print(f"⚠ capture archive maintenance failed: {e}", file=sys.stderr)
+
+    def close(self):
+        """Wait for queued writes (and any packing in progress) to finish"""
+        with self.queue_lock:
+            writer = self.writer
+        if writer:
+            writer.join()
+
+    # ===== packing and rotation =====
+
+    def _loose(self):
+        """Loose capture files, oldest first"""
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.is_file() and not entry.name.startswith(('index.json', '.')):
+                entries.append((entry.stat().st_mtime, entry.name, entry.stat().st_size))
+        return sorted(entries)
+
+    def maintain(self):
+        """Pack old loose captures into a segment, then enforce the budget"""
+        with self.maintain_lock:
+            loose = self._loose()
+            now = time.time()
+            candidates = loose[:-KEEP_LOOSE] if len(loose) > KEEP_LOOSE else []
+            if len(loose) > MAX_LOOSE:
+                to_pack = candidates
+            else:
+                to_pack = [c for c in candidates if now - c[0] > LOOSE_AGE]
+            if to_pack:
+                self._pack(to_pack)
+            self._rotate(now)
+
+    def _pack(self, files):
+        oldest, newest = files[0][0], files[-1][0]
+        stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(oldest))
+        segment = f"seg_{stamp}_{len(files)}.zip"
+        counter = 1
+        while segment in self.index['segments'] or os.path.exists(os.path.join(self.segments_dir, segment)):
+            counter += 1
+            segment = f"seg_{stamp}_{len(files)}_{counter}.zip"
+        path = os.path.join(self.segments_dir, segment)
+        tmp_path = path + '.tmp'
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for mtime, name, size in files:
+                # JPEGs are already compressed - store them, deflate the ASCII text
+                compress = zipfile.ZIP_STORED if name.lower().endswith('.jpg') else zipfile.ZIP_DEFLATED
+                archive.write(os.path.join(self.root, name), name, compress_type=compress)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.index['segments'][segment] = {'bytes': os.path.getsize(path), 'oldest': oldest, 'newest': newest}
+            for mtime, name, size in files:
+                self.index['captures'][name] = {'segment': segment, 'size': size, 'time': mtime}
+            self._save_index()
+        for mtime, name, size in files:
+            os.unlink(os.path.join(self.root, name))
+
+    def _rotate(self, now):
+        loose_bytes = sum(size for _, _, size in self._loose())
+        with self.lock:
+            segments = sorted(self.index['segments'].items(), key=lambda kv: kv[1]['newest'])
+            total = loose_bytes + sum(info['bytes'] for _, info in segments)
+            dropped = []
+            for segment, info in segments:
+                if total <= MAX_BYTES and now - info['newest'] <= MAX_AGE:
+                    break
+                total -= info['bytes']
+                del self.index['segments'][segment]
+                self.index['captures'] = {
+                    name: entry for name, entry in self.index['captures'].items() if entry['segment'] != segment}
+                dropped.append(segment)
+            if dropped:
+                self._save_index()
+        for segment in dropped:
+            path = os.path.join(self.segments_dir, segment)
+            if os.path.exists(path):
+                os.unlink(path)
+
+    # ===== lookups =====
+
+    def find(self, prefix=''):
+        """Names of archived captures (loose and packed) starting with prefix, newest first"""
+        found = {name: mtime for mtime, name, _ in self._loose() if name.startswith(prefix)}
+        with self.lock:
+            for name, entry in self.index['captures'].items():
+                if name.startswith(prefix):
+                    found.setdefault(name, entry['time'])
+        return sorted(found, key=found.get, reverse=True)
+
+    def get(self, name):
+        """Bytes of one capture, from disk or its segment (None if it's gone)"""
+        path = os.path.join(self.root, name)
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                return f.read()
+        with self.lock:
+            entry = self.index['captures'].get(name)
+        if entry is None:
+            return None
+        try:
+            with zipfile.ZipFile(os.path.join(self.segments_dir, entry['segment'])) as archive:
+                return archive.read(name)
+        except (OSError, KeyError, zipfile.BadZipFile):
+            return None
+
+
+if __name__ == '__main__':
+    store = CaptureStore()
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+    if command == 'list':
+        for name in store.find(sys.argv[2] if len(sys.argv) > 2 else ''):
+            print(name)
+    elif command == 'get' and len(sys.argv) > 2:
+        data = store.get(sys.argv[2])
+        if data is None:
+            print(f"✗ {sys.argv[2]} not found", file=sys.stderr)
+            sys.exit(1)
+        output = sys.argv[3] if len(sys.argv) > 3 else sys.argv[2]
+        with open(output, 'wb') as f:
+            f.write(data)
+        print(f"✓ wrote {output}")
+    elif command == 'pack':
+        store.maintain()
+        print(f"✓ {len(store.index['segments'])} segment(s), {len(store.index['captures'])} packed capture(s)")
+    else:
+        print("Usage: python3 terminal/capture_store.py list [prefix] | get <name> [output] | pack")
+        sys.exit(1)
@@ -1,6 +1,7 @@
 const mqtt = require('mqtt');
 const blessed = require('blessed');
-const { spawn } = require('child_process');
+const { spawn, exec } = require('child_process');
+const fs = require('fs');
 
 // ==== TERMINAL PALETTE & SYMBOLS ====
 // added for better compatibility in Raspberry Pi terminals, but some colors kinda wonky
@@ -36,15 +37,26 @@ const PUB_TOPIC = `messages/${FRIEND_NAME}`;
 const PRESENCE_TOPIC = `presence/${FRIEND_NAME}`;
 const MY_PRESENCE_TOPIC = `presence/${MY_NAME}`;
 const ASCII_RECEIEVE = `ascii/${MY_NAME}`;
+const FRIEND_STATUS_TOPIC = `status/${FRIEND_NAME}`; // friend's print queue status
 
 const HEARTBEAT_INTERVAL = 5000; // 5 seconds
+const MQTT_V5 = true; // topic aliases, message expiry and resumable sessions
+const SESSION_EXPIRY = 3600; // seconds the broker keeps our subscriptions
+const TEXT_EXPIRY = 6 * 3600; // seconds before an undelivered message is dropped
+const PRESENCE_EXPIRY = 15; // seconds
 const PRESENCE_TIMEOUT = 10000; // 10 seconds
+const TRACE_FILE = `traces/${MY_NAME}.jsonl`; // shared with the portal and sender, see tracing.py
+const RESIDENT = true; // keep a warm portal (on standby) and sender running so /printer and /p start fast
 let heartbeatTimer = null;
 let presenceTimeout = null;
 
 // ==== PRINTER STATE ====
 let printerEnabled = false;
 let printerProcess = null;
+let senderProcess = null; // resident ascii-cam-sender.py --serve
+const senderCallbacks = []; // pending /p captures, answered in order
+let friendPrinter = null; // friend's print queue status (combined across a portal fleet)
+const friendPrinters = {}; // status topic -> last status from that portal
 
 // ==== UI SETUP ====
 const screen = blessed.screen({
@@ -102,18 +114,34 @@ input.focus(); // focus on input after setup
 screen.render();
 
 // ==== MQTT CONNECTION ====
-const client = mqtt.connect(BROKER_URL);
+const client = mqtt.connect(BROKER_URL, MQTT_V5 ? {
+    protocolVersion: 5,
+    clientId: `chat-${MY_NAME}`,
+    clean: false,
+    properties: { sessionExpiryInterval: SESSION_EXPIRY },
+    autoAssignTopicAlias: true,
+    autoUseTopicAlias: true,
+} : {});
+
+function expiryOptions(seconds) {
+    return MQTT_V5 ? { properties: { messageExpiryInterval: seconds } } : {};
+}
 
-client.on('connect', () => {
+client.on('connect', (connack) => {
     log.add('{green-fg}✓ Connected to MQTT{/}');
-    client.subscribe([SUB_TOPIC, PRESENCE_TOPIC, ASCII_RECEIEVE], () => {
-        screen.render();
-    });
+    if (MQTT_V5 && connack && connack.sessionPresent) {
+        screen.render(); // broker kept our subscriptions
+    } else {
+        client.subscribe([SUB_TOPIC, PRESENCE_TOPIC, ASCII_RECEIEVE, FRIEND_STATUS_TOPIC, `${FRIEND_STATUS_TOPIC}/+`], { qos: 1 }, () => {
+            screen.render();
+        });
+    }
 
     // presence heartbeat
     function sendHeartbeat() {
-        client.publish(MY_PRESENCE_TOPIC, 'online', { retain: true });
+        client.publish(MY_PRESENCE_TOPIC, 'online', { retain: true, ...expiryOptions(PRESENCE_EXPIRY) });
     }
+    clearInterval(heartbeatTimer);
     heartbeatTimer = setInterval(sendHeartbeat, HEARTBEAT_INTERVAL);
     sendHeartbeat(); // send immediately
 
@@ -122,6 +150,17 @@ client.on('connect', () => {
     screen.render();
 });
 
+// Log a sent message's trace stages and the broker's ack time (PUBACK) for tracing.py
+function recordTrace(trace, ackedAt) {
+    const stages = { ...trace.stages, broker: ackedAt };
+    const lines = Object.entries(stages).map(([stage, t]) => JSON.stringify({
+        trace: trace.id, site: MY_NAME, clock: MY_NAME, stage, t,
+    }) + '\n');
+    fs.mkdir('traces', { recursive: true }, () => {
+        fs.appendFile(TRACE_FILE, lines.join(''), () => {});
+    });
+}
+
 function getTimeString() {
     return new Date().toLocaleString('en-US', { hour12: true });
 }
@@ -149,6 +188,11 @@ client.on('message', (topic, message) => {
         return;
     }
 
+    if (topic === FRIEND_STATUS_TOPIC || topic.startsWith(`${FRIEND_STATUS_TOPIC}/`)) {
+        updateFriendPrinter(topic, msg);
+        return;
+    }
+
     if (topic === ASCII_RECEIEVE) {
         process.stdout.write('\x07'); // play bell sound
         log.add(`{${palette.info}}[${now}] ${symbols.arrowFrom} ${FRIEND_NAME}: sent an ASCII image{/}`);
@@ -187,6 +231,7 @@ input.on('submit', (text) => {
     // to quit
     if (trimmed === '/exit') {
         cleanupPrinter();
+        cleanupSender();
         clearInterval(heartbeatTimer);
         client.publish(MY_PRESENCE_TOPIC, 'offline', { retain: true, qos: 1 }, () => {
             client.end();
@@ -195,8 +240,8 @@ input.on('submit', (text) => {
         return;
     }
 
-    // to take photo
-    if (trimmed === '/p') {
+    // to take photo (/p! skips the busy-printer check)
+    if (trimmed === '/p' || trimmed === '/p!') {
         if (!isOnline) {
             log.add(`{${palette.error}} Cannot send image: friend is offline{/}`);
             screen.render();
@@ -205,17 +250,28 @@ input.on('submit', (text) => {
             return;
         }
 
+        if (trimmed === '/p' && friendPrinter && friendPrinter.saturated) {
+            log.add(`{${palette.warning}}${FRIEND_NAME}'s printer is busy (${friendPrinter.queue_depth} queued, ~${Math.round(friendPrinter.drain_seconds)}s to drain){/}`);
+            log.add(`{${palette.warning}}Try again in a bit, or use /p! to send anyway{/}`);
+            screen.render();
+            input.clearValue();
+            input.focus();
+            return;
+        }
+
         log.add(`{${palette.warning}}Capturing image... hold your pose...{/}`);
         screen.render();
 
-        const { exec } = require('child_process');
-        exec(`python3 terminal/ascii-cam-sender.py ${MY_NAME} ${FRIEND_NAME}`, (err, stdout, stderr) => {
+        runSender((err, stdout, stderr) => {
             const now = getTimeString();
             if (err) {
                 log.add(`{${palette.error}}${symbols.cross} Failed to capture/send image{/}`);
                 log.add(stderr);
             } else {
                 log.add(`{${palette.info}}[${now}] ${symbols.arrowTo} you: sent an ASCII image{/}`);
+                String(stderr || '').split('\n')
+                    .filter(line => line.startsWith('⚠') || line.startsWith('⏳') || line.startsWith('⏱'))
+                    .forEach(line => log.add(`{${palette.warning}}${line}{/}`));
                 if (stdout && stdout.trim()) {
                     const displayAscii = isBasicTerminal ? trimAsciiArt(stdout.trim(), 56) : stdout.trim();
                     log.add(displayAscii);
@@ -232,20 +288,34 @@ input.on('submit', (text) => {
 
     // to toggle printer
     if (trimmed === '/printer') {
-        if (printerProcess) {
-            // If portal is running, stop it
-            cleanupPrinter();
-            printerEnabled = false;
+        if (printerEnabled) {
+            // If portal is running, stop it (back to standby when resident)
+            stopPrinter();
         } else {
             // If portal is not running, start it
-            startPrinterPortal();
-            printerEnabled = true;
+            startPrinter();
         }
         input.clearValue();
         input.focus();
         return;
     }
 
+    // to reprint an archived image or list the archive (handled by the local portal)
+    if (trimmed.startsWith('/reprint') || trimmed === '/archive') {
+        if (!printerProcess || !printerEnabled) {
+            // A resident portal is always running, but only prints while the printer is on
+            log.add(`{${palette.error}}${symbols.cross} Printer is off (use /printer){/}`);
+        } else if (trimmed.startsWith('/reprint') && trimmed.split(/\s+/).length !== 2) {
+            log.add(`{${palette.error}}${symbols.cross} Usage: /reprint <id>{/}`);
+        } else {
+            printerProcess.stdin.write(trimmed + '\n');
+        }
+        screen.render();
+        input.clearValue();
+        input.focus();
+        return;
+    }
+
     // to check printer status
     if (trimmed === '/status') {
         const printerStatus = printerEnabled ? 'on' : 'off';
@@ -260,8 +330,11 @@ input.on('submit', (text) => {
     if (trimmed === '/help') {
         log.add(`{${palette.info}}${symbols.star} Available Commands:{/}`);
         log.add(`  /p - Take and send photo`);
+        log.add(`  /p! - Send photo even if friend's printer is busy`);
         log.add(`  /printer - Toggle printer on/off`);
         log.add(`  /status - Check printer status`);
+        log.add(`  /archive - List recently printed images`);
+        log.add(`  /reprint <id> - Reprint an archived image`);
         log.add(`  /help - Show this help message`);
         log.add(`  /exit - Quit the application`);
         screen.render();
@@ -271,14 +344,19 @@ input.on('submit', (text) => {
     }
 
     const now = getTimeString();
+    const traceId = Math.random().toString(16).slice(2, 10) + Date.now().toString(16).slice(-8);
     const msg = {
+        id: `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`,
         from: MY_NAME,
         to: FRIEND_NAME,
         text: text.trim(),
         time: now,
+        trace: { id: traceId, origin: MY_NAME, stages: { publish: Date.now() / 1000 } },
     };
 
-    client.publish(PUB_TOPIC, JSON.stringify(msg));
+    client.publish(PUB_TOPIC, JSON.stringify(msg), { qos: 1, ...expiryOptions(TEXT_EXPIRY) }, (err) => {
+        if (!err) recordTrace(msg.trace, Date.now() / 1000);
+    });
     log.add(`{${palette.info}}[${now}] ${symbols.arrowTo} you:{/} ${msg.text}`);
     input.clearValue();
     input.focus();
@@ -288,6 +366,7 @@ input.on('submit', (text) => {
 // ==== QUIT ==== -- this doesn't work
 screen.key(['q', 'C-c'], () => {
     cleanupPrinter();
+    cleanupSender();
     clearInterval(heartbeatTimer);
     client.publish(MY_PRESENCE_TOPIC, 'offline', { retain: true, qos: 1 }, () => {
         client.end();
@@ -309,7 +388,8 @@ function updateStatus(status) {
     const myStatus = isOnline ? symbols.online : symbols.offline;
     const friendStatus = isOnline ? symbols.online : symbols.offline;
     presenceBox.setContent(
-        ` ${friendStatus} {bold}${FRIEND_NAME}{/bold} is ${isOnline ? 'online' : 'offline'}  ${printerSymbol} printer ${printerEnabled ? 'on' : 'off'}`
+        ` ${friendStatus} {bold}${FRIEND_NAME}{/bold} is ${isOnline ? 'online' : 'offline'}  ${printerSymbol} printer ${printerEnabled ? 'on' : 'off'}` +
+        friendPrinterSummary()
     );
     if (isOnline && !wasOnline) {
         process.stdout.write('\x07'); // play bell sound when friend comes online
@@ -317,19 +397,88 @@ function updateStatus(status) {
     screen.render(); // force full UI redraw
 }
 
+// ==== FRIEND'S PRINT QUEUE ====
+function combineFriendPrinters() {
+    const live = Object.values(friendPrinters).filter(s => s.printer !== 'offline');
+    if (live.length === 0) return { printer: 'offline' };
+    const senders = {};
+    live.forEach(s => Object.entries(s.senders || {}).forEach(([name, b]) => {
+        const total = senders[name] || { deferred: 0, rejected: 0 };
+        senders[name] = { deferred: total.deferred + (b.deferred || 0), rejected: total.rejected + (b.rejected || 0) };
+        if (b.tokens !== undefined) senders[name].tokens = Math.min(b.tokens, total.tokens ?? b.tokens);
+    }));
+    return {
+        printer: live.some(s => s.printer === 'printing') ? 'printing' : live[0].printer,
+        queue_depth: live.reduce((sum, s) => sum + (s.queue_depth || 0), 0),
+        drain_seconds: Math.min(...live.map(s => s.drain_seconds || 0)),
+        saturated: live.every(s => s.saturated), // any idle portal in the fleet can take it
+        senders,
+    };
+}
+
+function updateFriendPrinter(topic, msg) {
+    try {
+        friendPrinters[topic] = JSON.parse(msg);
+    } catch (err) {
+        return;
+    }
+    const status = combineFriendPrinters();
+
+    const mine = (status.senders || {})[MY_NAME] || {};
+    const before = (friendPrinter && (friendPrinter.senders || {})[MY_NAME]) || {};
+    if ((mine.deferred || 0) > (before.deferred || 0) || (mine.rejected || 0) > (before.rejected || 0)) {
+        log.add(`{${palette.warning}}${symbols.star} ${FRIEND_NAME}'s printer is rate limiting you, slow down a little{/}`);
+    }
+    if (status.saturated && !(friendPrinter && friendPrinter.saturated)) {
+        log.add(`{${palette.warning}}${symbols.star} ${FRIEND_NAME}'s printer is backed up (~${Math.round(status.drain_seconds)}s){/}`);
+    }
+
+    friendPrinter = status;
+    updateStatus(isOnline ? 'online' : 'offline'); // refresh display
+}
+
+function friendPrinterSummary() {
+    if (!friendPrinter || friendPrinter.printer === 'offline') return '';
+    const queue = friendPrinter.queue_depth ? ` ${friendPrinter.queue_depth} queued` : '';
+    return `  | their printer: ${friendPrinter.printer}${queue}`;
+}
+
 // ==== PRINTER FUNCTIONS ====
-function startPrinterPortal() {
+function startPrinter() {
+    if (RESIDENT && printerProcess) {
+        // Already loaded on standby - just bring it online
+        log.add(`{${palette.warning}}⇣ Starting printer portal...{/}`);
+        printerProcess.stdin.write('/start\n');
+        printerEnabled = true;
+        updateStatus(isOnline ? 'online' : 'offline'); // refresh display
+    } else {
+        startPrinterPortal();
+    }
+}
+
+function stopPrinter() {
+    if (RESIDENT && printerProcess) {
+        log.add(`{${palette.warning}}⌁ Stopping printer portal...{/}`);
+        printerProcess.stdin.write('/stop\n');
+        printerEnabled = false;
+        updateStatus(isOnline ? 'online' : 'offline'); // refresh display
+    } else {
+        cleanupPrinter();
+    }
+}
+
+function startPrinterPortal(standby = false) {
     if (printerProcess) {
         log.add(`{${palette.error}}✖ Printer portal already running{/}`);
         screen.render();
         return;
     }
 
-    log.add(`{${palette.warning}}⇣ Starting printer portal...{/}`);
+    log.add(`{${palette.warning}}⇣ ${standby ? 'Loading printer portal (standby)' : 'Starting printer portal'}...{/}`);
     screen.render();
 
     // Start the printer portal as a background process
-    printerProcess = spawn('python3', ['nyc-printer-portal.py'], {
+    printerProcess = spawn('python3', ['nyc-printer-portal.py', ...(standby ? ['--standby'] : [])], {
         stdio: ['pipe', 'pipe', 'pipe'],
         detached: false
     });
@@ -366,8 +515,8 @@ function startPrinterPortal() {
         screen.render();
     });
 
-    // Set printer as enabled when portal starts
-    printerEnabled = true;
+    // Set printer as enabled when portal starts (standby waits for /printer)
+    printerEnabled = !standby;
     updateStatus(isOnline ? 'online' : 'offline'); // refresh display
 }
 
@@ -380,3 +529,65 @@ function cleanupPrinter() {
         updateStatus(isOnline ? 'online' : 'offline'); // refresh display
     }
 }
+
+// ==== SENDER FUNCTIONS ====
+function startResidentSender() {
+    senderProcess = spawn('python3', ['terminal/ascii-cam-sender.py', '--serve', MY_NAME, FRIEND_NAME], {
+        stdio: ['pipe', 'pipe', 'pipe'],
+        detached: false
+    });
+
+    // One JSON line per capture: {ok, stdout, stderr}
+    let buffered = '';
+    senderProcess.stdout.on('data', (data) => {
+        buffered += data.toString();
+        let newline;
+        while ((newline = buffered.indexOf('\n')) >= 0) {
+            const line = buffered.slice(0, newline);
+            buffered = buffered.slice(newline + 1);
+            let reply;
+            try {
+                reply = JSON.parse(line);
+            } catch (e) {
+                continue;
+            }
+            if (reply.ready) continue;
+            const callback = senderCallbacks.shift();
+            if (callback) callback(reply.ok ? null : new Error('capture failed'), reply.stdout, reply.stderr);
+        }
+    });
+    senderProcess.stderr.on('data', () => {}); // replies carry their own stderr
+
+    senderProcess.on('close', () => {
+        senderProcess = null;
+        senderCallbacks.splice(0).forEach(callback => callback(new Error('sender exited'), '', ''));
+    });
+    senderProcess.on('error', () => {
+        senderProcess = null;
+    });
+}
+
+// Capture and send a photo through the resident sender, or a fresh process without one.
+// The sender gets the friend's printer status we already follow instead of asking the broker again.
+function runSender(callback) {
+    const status = friendPrinter || {};
+    if (senderProcess) {
+        senderCallbacks.push(callback);
+        senderProcess.stdin.write(JSON.stringify({ status }) + '\n');
+    } else {
+        exec(`python3 terminal/ascii-cam-sender.py ${MY_NAME} ${FRIEND_NAME}`,
+            { env: { ...process.env, RECEIVER_STATUS: JSON.stringify(status) } }, callback);
+    }
+}
+
+function cleanupSender() {
+    if (senderProcess) {
+        senderProcess.kill('SIGTERM');
+        senderProcess = null;
+    }
+}
+
+if (RESIDENT) {
+    startPrinterPortal(true);
+    startResidentSender();
+}
@@ -0,0 +1,38 @@
+import threading
+
+from admission import ADMIT, DEFER, REJECT, AdmissionControl, TokenBucket
+
+
+def test_bucket_allows_a_burst_then_asks_for_a_wait():
+    bucket = TokenBucket(rate=1.0, burst=3)
+    assert [bucket.reserve(1) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert 0.9 < bucket.reserve(1) <= 1.0
+
+
+def test_admit_defer_reject():
+    admission = AdmissionControl(rate=1.0, burst=2, max_defer=3)
+    submitted = []
+    decisions = [admission.admit('a', 1, lambda: submitted.append(1))[0] for _ in range(8)]
+    assert decisions[:2] == [ADMIT, ADMIT]
+    assert decisions[2:5] == [DEFER, DEFER, DEFER]
+    assert set(decisions[5:]) == {REJECT}
+    assert len(submitted) == 2
+    assert admission.deferred_count() == 3
+    assert admission.snapshot()['a']['rejected'] == 3
+
+
+def test_deferred_job_runs_once_its_tokens_arrive():
+    admission = AdmissionControl(rate=20.0, burst=1, max_defer=1)
+    released = threading.Event()
+    admission.admit('a', 1, lambda: None)
+    decision, wait = admission.admit('a', 1, released.set)
+    assert decision == DEFER and wait > 0
+    assert released.wait(2)
+    assert admission.deferred_count() == 0
+
+
+def test_senders_have_separate_buckets():
+    admission = AdmissionControl(rate=1.0, burst=1, max_defer=0)
+    assert admission.admit('a', 1, lambda: None)[0] == ADMIT
+    assert admission.admit('a', 1, lambda: None)[0] == REJECT
+    assert admission.admit('b', 1, lambda: None)[0] == ADMIT
@@ -0,0 +1,48 @@
+import os
+import time
+
+import capture_store
+from capture_store import CaptureStore
+
+START = time.time() - 3600
+
+
+def fill(store, count):
+    for i in range(count):
+        name = f"capture_{i:03d}.txt"
+        store.add(name, f"capture {i}".encode())
+        store.close()
+        path = os.path.join(store.root, name)
+        os.utime(path, (START + i, START + i))  # distinct mtimes, oldest first
+
+
+def test_one_shot_store_only_writes(tmp_path, monkeypatch):
+    monkeypatch.setattr(capture_store, 'MAX_LOOSE', 3)
+    monkeypatch.setattr(capture_store, 'KEEP_LOOSE', 1)
+    store = CaptureStore(str(tmp_path), pack=False)
+    fill(store, 5)
+    assert store.index['segments'] == {}
+    assert len(store.find('capture_')) == 5
+
+
+def test_packed_captures_can_still_be_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(capture_store, 'MAX_LOOSE', 3)
+    monkeypatch.setattr(capture_store, 'KEEP_LOOSE', 1)
+    store = CaptureStore(str(tmp_path), pack=False)
+    fill(store, 5)
+    store.maintain()
+    assert len(store.index['captures']) == 4
+    assert store.get('capture_000.txt') == b"capture 0"
+    assert store.find('capture_')[0] == 'capture_004.txt'
+
+
+def test_add_does_not_wait_for_packing(tmp_path):
+    store = CaptureStore(str(tmp_path))
+    with store.maintain_lock:  # a packing pass is running
+        started = time.monotonic()
+        store.add('capture_new.txt', b"new")
+        assert time.monotonic() - started < 0.5
+        with store.lock:  # lookups aren't blocked by it either
+            pass
+    store.close()
+    assert store.get('capture_new.txt') == b"new"
@@ -0,0 +1,88 @@
+import json
+
+import fleet
+from fleet import FleetGuard, SeenJobs, job_id_for
+
+
+class Bus:
+    """Delivers every publish to all guards, like the broker would"""
+
+    def __init__(self):
+        self.guards = []
+
+    def publish(self, topic, payload, content_type=None, retain=False):
+        for guard in self.guards:
+            guard.handle(topic, payload)
+
+
+def make_fleet(*instances):
+    bus = Bus()
+    bus.guards = [FleetGuard('nyc', 'nyc', name, bus.publish) for name in instances]
+    return bus.guards
+
+
+def test_simultaneous_claims_go_to_one_instance(monkeypatch):
+    monkeypatch.setattr(fleet, 'CLAIM_SETTLE', 0)
+    office, kitchen = make_fleet('office', 'kitchen')
+    # Both got the job before seeing each other's claim
+    office.mine['job'] = kitchen.mine['job'] = 0
+    office._publish_claim('job', 'claimed')
+    kitchen._publish_claim('job', 'claimed')
+    assert [office.won('job'), kitchen.won('job')].count(True) == 1
+
+
+def test_printing_claim_beats_a_later_one(monkeypatch):
+    monkeypatch.setattr(fleet, 'CLAIM_SETTLE', 0)
+    office, kitchen = make_fleet('office', 'kitchen')
+    assert office.claim('job')
+    assert office.won('job')
+    # kitchen ('k' < 'o') claims late, e.g. a delayed redelivery
+    kitchen.mine['job'] = 0
+    kitchen._publish_claim('job', 'claimed')
+    assert not kitchen.won('job')
+    assert office.won('job')  # a retry keeps the job
+
+
+def test_dead_instances_job_is_taken_over(monkeypatch):
+    monkeypatch.setattr(fleet, 'CLAIM_SETTLE', 0)
+    office, kitchen = make_fleet('office', 'kitchen')
+    assert office.claim('job') and office.won('job')
+    kitchen.handle(kitchen.instances_prefix + 'office', 'offline')
+    assert kitchen.claim('job')
+    assert kitchen.won('job')
+
+
+def test_printed_job_is_never_claimed_again(monkeypatch):
+    monkeypatch.setattr(fleet, 'CLAIM_SETTLE', 0)
+    office, kitchen = make_fleet('office', 'kitchen')
+    assert office.claim('job') and office.won('job')
+    office.printed('job')
+    kitchen.handle(kitchen.instances_prefix + 'office', 'offline')
+    assert not kitchen.claim('job')
+
+
+def test_dropped_jobs_can_be_claimed_again_after_stop(monkeypatch):
+    monkeypatch.setattr(fleet, 'CLAIM_SETTLE', 0)
+    office, = make_fleet('office')
+    assert office.claim('queued')
+    assert office.claim('done') and office.won('done')
+    office.printed('done')
+    office.release_unprinted()
+    assert office.claim('queued')  # the broker's redelivery after /start
+    assert not office.claim('done')
+
+
+def test_redelivered_message_is_a_duplicate_until_dropped():
+    payload = '{"id": "m1", "from": "shanghai-cedar", "text": "hi"}'
+    seen = SeenJobs()
+    job_id = job_id_for(json.loads(payload), payload)
+    first = seen.add(job_id)
+    assert first is not None
+    assert seen.add(job_id_for(json.loads(payload), payload)) is None  # same message, redelivered
+    seen.forget_unfinished()  # /stop dropped it before it printed
+    assert not seen.current(job_id, first)  # its deferred submit is stale now
+    again = seen.add(job_id)
+    assert again is not None
+    seen.finished(job_id)
+    seen.forget_unfinished()
+    assert seen.add(job_id) is None  # printed: never again
@@ -0,0 +1,31 @@
+import os
+
+from image_archive import ImageArchive
+
+
+def test_reprint_id_finds_the_archived_original(tmp_path):
+    archive = ImageArchive(str(tmp_path))
+    image_id = archive.add_original(b'photo bytes', 'cedar', '2024-01-01 10:00:00', 'a.jpg')
+    key, entry = archive.get(image_id[:6])
+    assert key == image_id
+    assert entry['sender'] == 'cedar'
+    with open(archive.original_path(image_id), 'rb') as f:
+        assert f.read() == b'photo bytes'
+
+
+def test_same_photo_is_stored_once(tmp_path):
+    archive = ImageArchive(str(tmp_path))
+    first = archive.add_original(b'same', 'cedar', 't1', 'a.jpg')
+    second = archive.add_original(b'same', 'cedar', 't2', 'b.jpg')
+    assert first == second
+    assert len(archive.recent()) == 1
+
+
+def test_composite_survives_eviction_even_over_budget(tmp_path):
+    archive = ImageArchive(str(tmp_path), budget=1000)
+    old = archive.add_original(b'o' * 400, 'cedar', 't1', 'old.jpg')
+    new = archive.add_original(b'n' * 600, 'cedar', 't2', 'new.jpg')
+    path = archive.add_composite(new, b'c' * 600)
+    assert os.path.exists(path)
+    assert archive.composite_path(new) == path
+    assert archive.get(old) == (None, None)  # the older photo made room
@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip('paho')
+
+from mqtt_v5 import TopicAliases
+
+
+class FakeClient:
+    def __init__(self):
+        self.sent = []
+
+    def publish(self, topic, payload, qos=0, retain=False, properties=None):
+        self.sent.append((topic, getattr(properties, 'TopicAlias', None)))
+
+
+class Connack:
+    TopicAliasMaximum = 2
+
+
+def test_alias_is_bound_once_then_sent_alone():
+    client = FakeClient()
+    aliases = TopicAliases(['presence/me'])
+    aliases.reset(Connack())
+    aliases.publish(client, 'presence/me', 'online')
+    aliases.publish(client, 'presence/me', 'online')
+    assert client.sent == [('presence/me', 1), ('', 1)]
+
+
+def test_no_alias_only_publish_after_disconnect():
+    client = FakeClient()
+    aliases = TopicAliases(['presence/me'])
+    aliases.reset(Connack())
+    aliases.publish(client, 'presence/me', 'online')
+    aliases.reset()  # disconnected: no CONNACK yet
+    aliases.publish(client, 'presence/me', 'online')
+    aliases.reset(Connack())  # reconnected: the alias has to be bound again
+    aliases.publish(client, 'presence/me', 'online')
+    assert client.sent[1:] == [('presence/me', None), ('presence/me', 1)]
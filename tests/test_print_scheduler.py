@@ -0,0 +1,163 @@
+import threading
+import time
+
+import print_scheduler
+from print_scheduler import (AGING_INTERVAL, PRIORITY_BANNER, PRIORITY_IMAGE, PRIORITY_TEXT,
+                             PrintScheduler)
+
+
+def run_all(scheduler):
+    """Start the worker on an already filled queue and wait until it's empty"""
+    done = threading.Event()
+    scheduler.submit(PRIORITY_BANNER + 10, 'test', done.set)  # sorts after everything else
+    scheduler.start()
+    assert done.wait(5)
+    scheduler.stop(1)
+
+
+def test_text_prints_before_images_and_banner():
+    scheduler = PrintScheduler()
+    order = []
+    scheduler.submit(PRIORITY_BANNER, 'me', lambda: order.append('banner'))
+    scheduler.submit(PRIORITY_IMAGE, 'a', lambda: order.append('image'))
+    scheduler.submit(PRIORITY_TEXT, 'a', lambda: order.append('text'))
+    run_all(scheduler)
+    assert order == ['text', 'image', 'banner']
+
+
+def test_senders_take_turns_within_a_class():
+    scheduler = PrintScheduler()
+    order = []
+    for i in range(3):
+        scheduler.submit(PRIORITY_TEXT, 'a', lambda i=i: order.append(f'a{i}'), cost=10)
+    scheduler.submit(PRIORITY_TEXT, 'b', lambda: order.append('b0'), cost=10)
+    run_all(scheduler)
+    assert order.index('b0') <= 1
+
+
+def test_aged_image_beats_fresh_text():
+    scheduler = PrintScheduler()
+    image = scheduler.submit(PRIORITY_IMAGE, 'a', lambda: None, cost=100000)
+    image.submitted -= AGING_INTERVAL * 1.3  # waited 39s: promoted into the text class
+    for _ in range(5):
+        scheduler.submit(PRIORITY_TEXT, 'b', lambda: None, cost=10)
+    with scheduler.cond:
+        assert scheduler._pick() is image
+
+
+def test_image_that_has_not_aged_waits_for_text():
+    scheduler = PrintScheduler()
+    image = scheduler.submit(PRIORITY_IMAGE, 'a', lambda: None, cost=1)
+    image.submitted -= AGING_INTERVAL * 0.5
+    text = scheduler.submit(PRIORITY_TEXT, 'b', lambda: None, cost=100000)
+    with scheduler.cond:
+        assert scheduler._pick() is text
+
+
+def test_drain_estimate_counts_queued_jobs():
+    scheduler = PrintScheduler()
+    scheduler.durations = {PRIORITY_TEXT: 2.0, PRIORITY_IMAGE: 20.0, PRIORITY_BANNER: 2.0}
+    scheduler.submit(PRIORITY_TEXT, 'a', lambda: None)
+    scheduler.submit(PRIORITY_IMAGE, 'a', lambda: None)
+    assert scheduler.queue_depth() == 2
+    assert scheduler.estimated_drain() == 22.0
+
+
+def test_failing_job_does_not_stop_the_worker():
+    scheduler = PrintScheduler()
+    printed = []
+
+    def fail():
+        raise RuntimeError("printer on fire")
+
+    scheduler.submit(PRIORITY_TEXT, 'a', fail)
+    scheduler.submit(PRIORITY_TEXT, 'a', lambda: printed.append(time.monotonic()))
+    run_all(scheduler)
+    assert printed
+
+
+def test_drain_estimate_counts_unknown_jobs_as_images():
+    scheduler = PrintScheduler()
+    scheduler.durations = {PRIORITY_TEXT: 2.0, PRIORITY_IMAGE: 20.0, PRIORITY_BANNER: 2.0}
+    scheduler.submit(PRIORITY_TEXT, 'a', lambda: None)
+    assert scheduler.estimated_drain(extra_jobs=3) == 62.0
+
+
+def test_batched_items_merge_until_the_batch_is_picked():
+    scheduler = PrintScheduler()
+    batches = []
+    first = scheduler.submit_batched(PRIORITY_TEXT, 'a', 'm1', batches.append)
+    assert scheduler.submit_batched(PRIORITY_TEXT, 'b', 'm2', batches.append) is first
+    assert scheduler.queue_depth() == 1
+    with scheduler.cond:
+        job = scheduler._pick()
+    job.action()
+    scheduler.submit_batched(PRIORITY_TEXT, 'a', 'm3', batches.append)
+    assert batches == [['m1', 'm2']]
+    assert scheduler.queue_depth() == 1  # m3 started a new batch
+
+
+def test_batched_items_are_counted_and_charged_one_by_one():
+    scheduler = PrintScheduler()
+    scheduler.submit_batched(PRIORITY_TEXT, 'a', 'm1', lambda items: None, cost=10)
+    scheduler.submit_batched(PRIORITY_TEXT, 'b', 'm2', lambda items: None, cost=30)
+    scheduler.submit_batched(PRIORITY_TEXT, 'b', 'm3', lambda items: None, cost=5)
+    assert scheduler.last_finish[(PRIORITY_TEXT, 'a')] == 10
+    assert scheduler.last_finish[(PRIORITY_TEXT, 'b')] == 35
+    with scheduler.cond:
+        job = scheduler._pick()
+        scheduler._record_wait(job)
+    assert scheduler.printed['text'] == 3
+    assert len(scheduler.waits['text']) == 3
+
+
+def test_on_done_runs_after_the_job_and_for_every_batched_item():
+    scheduler = PrintScheduler()
+    events = []
+    scheduler.submit(PRIORITY_IMAGE, 'a', lambda: events.append('printed'),
+                     on_done=lambda: events.append('acked'))
+    for item in ('x', 'y'):
+        scheduler.submit_batched(PRIORITY_TEXT, 'a', item, lambda items: events.append(list(items)),
+                                 on_done=lambda item=item: events.append(f'acked {item}'))
+    run_all(scheduler)
+    assert events == [['x', 'y'], 'acked x', 'acked y', 'printed', 'acked']
+
+
+def test_failed_job_is_retried_before_on_done(monkeypatch):
+    monkeypatch.setattr(print_scheduler, 'RETRY_DELAY', 0)
+    scheduler = PrintScheduler()
+    attempts = []
+    acked = threading.Event()
+    scheduler.submit(PRIORITY_TEXT, 'a', lambda: attempts.append(1) or len(attempts) == 2,
+                     on_done=acked.set)
+    scheduler.start()
+    assert acked.wait(5)
+    scheduler.stop(1)
+    assert len(attempts) == 2
+
+
+def test_job_is_given_up_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(print_scheduler, 'RETRY_DELAY', 0)
+    scheduler = PrintScheduler()
+    attempts = []
+    acked = threading.Event()
+    scheduler.submit(PRIORITY_TEXT, 'a', lambda: attempts.append(1) or False, on_done=acked.set)
+    scheduler.start()
+    assert acked.wait(5)
+    scheduler.stop(1)
+    assert len(attempts) == print_scheduler.MAX_ATTEMPTS
+
+
+def test_pause_drops_the_queue_until_resumed():
+    scheduler = PrintScheduler()
+    order = []
+    scheduler.submit(PRIORITY_TEXT, 'a', lambda: order.append('queued'), on_done=lambda: order.append('acked'))
+    assert len(scheduler.pause()) == 1
+    assert scheduler.submit(PRIORITY_TEXT, 'a', lambda: order.append('while paused')) is None
+    assert scheduler.submit_batched(PRIORITY_TEXT, 'a', 'x', lambda items: order.append(items)) is None
+    scheduler.start()
+    assert scheduler.wait_idle(1)
+    scheduler.resume()
+    scheduler.submit(PRIORITY_TEXT, 'a', lambda: order.append('after resume'))
+    run_all(scheduler)
+    assert order == ['after resume']
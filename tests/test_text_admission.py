@@ -0,0 +1,26 @@
+"""Texts go through admission control before they join the print batch."""
+import threading
+
+from admission import ADMIT, DEFER, REJECT, AdmissionControl
+from print_scheduler import PRIORITY_TEXT, PrintScheduler
+
+
+def test_only_admitted_texts_print_with_the_first_batch():
+    admission = AdmissionControl(rate=0.5, burst=10, max_defer=60)
+    scheduler = PrintScheduler()
+    printed = []
+    decisions = []
+    for i in range(45):
+        submit = lambda i=i: scheduler.submit_batched(PRIORITY_TEXT, 'a', i, printed.append)
+        decisions.append(admission.admit('a', 1, submit)[0])
+
+    assert decisions.count(ADMIT) == 10
+    assert decisions.count(DEFER) == 30
+    assert decisions.count(REJECT) == 5
+
+    done = threading.Event()
+    scheduler.submit(PRIORITY_TEXT + 5, 'test', done.set)
+    scheduler.start()
+    assert done.wait(5)
+    scheduler.stop(1)
+    assert printed == [list(range(10))]  # deferred texts wait for their tokens, rejected never print
@@ -0,0 +1,45 @@
+import re
+
+from text_layout import BODY_SIZE, NO_LINE_START, normalize, render_messages, text_width, wrap
+
+WIDTH = 200
+
+
+def test_wrapped_lines_fit_and_long_words_are_broken():
+    text = "the quick brown fox " * 20 + "z" * 300
+    lines = wrap(text, BODY_SIZE, WIDTH)
+    assert all(text_width(line, BODY_SIZE) <= WIDTH for line in lines)
+    broken = [line for line in lines if 'z' in line]
+    assert len(broken) > 1  # the 300-character word spans several lines
+    assert ''.join(broken) == "z" * 300
+
+
+def test_no_line_start_punctuation_stays_on_the_previous_line():
+    text = "今日はとても良い天気ですね。散歩に行きましょう！" * 10 + "Hello, world. Wait... okay! " * 10
+    lines = wrap(text, BODY_SIZE, WIDTH)
+    assert len(lines) > 3
+    assert not any(line[0] in NO_LINE_START for line in lines if line)
+
+
+def test_emoji_are_printed_as_names():
+    assert normalize("hi 😀‍") == "hi [grinning face]"
+    assert normalize("☕️") == "[hot beverage]"
+
+
+def test_many_messages_pack_onto_several_pages():
+    messages = [("nyc-boshi", f"message {i} " + "words " * 30, "12:00:00") for i in range(40)]
+    pdf, pages = render_messages(messages)
+    assert pages > 1
+    assert pages < len(messages)  # several messages share a page
+    assert len(re.findall(rb"/Type /Page ", pdf)) == pages
+    assert re.search(rb"/Count (\d+)", pdf).group(1) == str(pages).encode()
+
+
+def test_xref_offsets_point_at_their_objects():
+    pdf, _ = render_messages([("shanghai-cedar", "你好 hello 🌏", "08:30:00")] * 5)
+    xref = int(re.search(rb"startxref\n(\d+)", pdf).group(1))
+    assert pdf[xref:].startswith(b"xref\n")
+    entries = re.findall(rb"(\d{10}) 00000 n ", pdf[xref:])
+    assert entries
+    for number, offset in enumerate(entries, start=1):
+        assert pdf[int(offset):].startswith(f"{number} 0 obj".encode())
@@ -0,0 +1,32 @@
+import tracing
+from tracing import ClockSync, TraceLog
+
+
+def test_clock_offset_from_a_ping_round_trip():
+    ours = ClockSync('nyc', 'shanghai')
+    theirs = ClockSync('shanghai', 'nyc')
+    reply = theirs.handle(ours.ping())
+    assert ours.handle(reply) is None
+    assert abs(ours.offset()) < 0.1  # same host, same clock
+    assert ours.handle(reply) is None and len(ours.samples) == 1  # duplicates are ignored
+
+
+def test_broker_ack_is_reported_apart_from_the_path_to_paper(tmp_path, capsys):
+    sender = TraceLog('shanghai', root=str(tmp_path))
+    portal = TraceLog('nyc', root=str(tmp_path))
+    sender.record_trace({'id': 't1', 'origin': 'shanghai',
+                         'stages': {'capture': 100.0, 'encode': 100.1, 'publish': 100.2}})
+    portal.record('t1', 'portal_receive', 100.3)
+    sender.record('t1', 'broker', 100.5)  # PUBACK arrives after the portal got it
+    portal.record('t1', 'submit', 101.0)
+    portal.record('t1', 'printed', 110.0)
+    for log in (sender, portal):
+        peer = 'nyc' if log is sender else 'shanghai'
+        log.record_offset(peer, 0.0, 0.01)
+
+    tracing.report([sender.path, portal.path])
+    lines = {line[:32].strip(): line for line in capsys.readouterr().out.splitlines()}
+    assert 'broker → portal_receive' not in lines and 'publish → broker' not in lines
+    assert lines['publish → portal_receive'].split()[4] == '100ms'
+    assert lines[tracing.ACK_NAME].split()[-1] == '300ms'
+    assert lines['end to end'].split()[-1] == '10000ms'
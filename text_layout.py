@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""Direct page layout for text messages.
+
+Renders chat messages straight to a small PDF so CUPS doesn't have to run its
+text-to-PDF filter on every job. Latin text uses the built-in Helvetica font
+and CJK text the standard STSong-Light CID font, so nothing has to be embedded;
+emoji are printed as their names since neither font has them. Several messages
+are packed onto each page instead of one message per sheet.
+"""
+import functools
+import unicodedata
+import zlib
+
+PAGE_SIZE = (612, 792)  # US Letter, points
+MARGIN = 36
+BODY_SIZE = 11
+HEADER_SIZE = 13
+META_SIZE = 9
+LINE_SPACING = 1.3
+BLOCK_GAP = 18  # points between packed messages
+
+LATIN_FONT = 'F1'
+CJK_FONT = 'F2'
+
+# Helvetica advance widths (1/1000 em) for ASCII 32..126, from the standard AFM
+HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+DEFAULT_LATIN_WIDTH = 556
+CJK_WIDTH = 1000
+
+# Characters that must not start a line (kept with the character before them)
+NO_LINE_START = set("。，、．・：；？！）」』】〉》〕”’ー…ぁぃぅぇぉっゃゅょァィゥェォッャュョ,.!?:;)]}%")
+DROPPED = {'\u200d', '\ufe0e', '\ufe0f'}  # zero-width joiner and variation selectors
+
+
+def is_emoji(ch):
+    cp = ord(ch)
+    return (0x1F000 <= cp <= 0x1FAFF or 0x2600 <= cp <= 0x27BF
+            or 0x1F1E6 <= cp <= 0x1F1FF or 0x2B00 <= cp <= 0x2BFF)
+
+
+def is_wide(ch):
+    return unicodedata.east_asian_width(ch) in ('W', 'F')
+
+
+def is_latin(ch):
+    try:
+        ch.encode('cp1252')
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+@functools.lru_cache(maxsize=4096)
+def char_width(ch):
+    """Advance width of one character in 1/1000 em"""
+    if is_wide(ch):
+        return CJK_WIDTH
+    code = ord(ch)
+    if 32 <= code <= 126:
+        return HELVETICA_WIDTHS[code - 32]
+    return DEFAULT_LATIN_WIDTH
+
+
+@functools.lru_cache(maxsize=8192)
+def text_width(text, size):
+    """Width of a string in points at the given font size (cached per word)"""
+    return sum(char_width(ch) for ch in text) * size / 1000.0
+
+
+def normalize(text):
+    """Replace things neither font can draw: emoji become [names], tabs spaces"""
+    out = []
+    for ch in text.replace('\t', '    ').replace('\r', ''):
+        if ch in DROPPED:
+            continue
+        if is_emoji(ch):
+            name = unicodedata.name(ch, '').lower()
+            out.append(f"[{name}]" if name else '?')
+        elif ch == '\n' or is_wide(ch) or is_latin(ch):
+            out.append(ch)
+        else:
+            out.append('?')
+    return ''.join(out)
+
+
+def tokenize(paragraph):
+    """Split a paragraph into breakable units: Latin words, spaces, single CJK chars"""
+    tokens = []
+    word = ''
+    for ch in paragraph:
+        if ch in NO_LINE_START and (word or tokens):
+            if word:
+                word += ch
+            else:
+                tokens[-1] += ch
+            continue
+        if ch == ' ' or is_wide(ch):
+            if word:
+                tokens.append(word)
+                word = ''
+            tokens.append(ch)
+        else:
+            word += ch
+    if word:
+        tokens.append(word)
+    return tokens
+
+
+def wrap(text, size, max_width):
+    """Word-wrap text (with CJK-aware breaks) into lines that fit max_width"""
+    lines = []
+    for paragraph in normalize(text).split('\n'):
+        line = ''
+        width = 0.0
+        for token in tokenize(paragraph):
+            token_width = text_width(token, size)
+            if token == ' ' and not line:
+                continue
+            if width + token_width <= max_width:
+                line += token
+                width += token_width
+                continue
+            if line:
+                lines.append(line.rstrip(' '))
+            line, width = '', 0.0
+            if token == ' ':
+                continue
+            # Break words that are wider than a whole line
+            while text_width(token, size) > max_width:
+                cut = 1
+                while cut < len(token) and text_width(token[:cut + 1], size) <= max_width:
+                    cut += 1
+                lines.append(token[:cut])
+                token = token[cut:]
+            line, width = token, text_width(token, size)
+        lines.append(line.rstrip(' '))
+    return lines
+
+
+def split_runs(line):
+    """Split a line into (font, text) runs"""
+    runs = []
+    for ch in line:
+        font = CJK_FONT if is_wide(ch) else LATIN_FONT
+        if runs and runs[-1][0] == font:
+            runs[-1][1] += ch
+        else:
+            runs.append([font, ch])
+    return runs
+
+
+def pdf_string(font, text):
+    if font == CJK_FONT:
+        return '<' + text.encode('utf-16-be').hex() + '>'
+    escaped = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return '(' + escaped + ')'
+
+
+class MessageBlock:
+    """One message laid out as header, rule and wrapped body lines"""
+
+    def __init__(self, sender, text, timestamp, width):
+        self.lines = []  # (font size, text) per line
+        self.lines.append((HEADER_SIZE, normalize(f"MESSAGE FROM: {sender}")))
+        self.lines.append((META_SIZE, normalize(f"Time: {timestamp}")))
+        self.lines.append((None, None))  # rule
+        for line in wrap(text, BODY_SIZE, width):
+            self.lines.append((BODY_SIZE, line))
+
+    @staticmethod
+    def line_height(size):
+        return (size or META_SIZE) * LINE_SPACING
+
+    def height(self):
+        return sum(self.line_height(size) for size, _ in self.lines)
+
+
+class PageLayout:
+    """Packs message blocks onto pages and writes them out as a PDF"""
+
+    def __init__(self, page_size=PAGE_SIZE, margin=MARGIN):
+        self.page_width, self.page_height = page_size
+        self.margin = margin
+        self.text_width = self.page_width - 2 * margin
+        self.pages = []
+        self.ops = None
+        self.y = 0
+
+    def _new_page(self):
+        self.ops = []
+        self.pages.append(self.ops)
+        self.y = self.page_height - self.margin
+
+    def add_message(self, sender, text, timestamp):
+        block = MessageBlock(sender, text, timestamp, self.text_width)
+        bottom = self.margin
+        if self.ops is None:
+            self._new_page()
+        elif self.y - BLOCK_GAP - block.height() < bottom:
+            # Start the block on a fresh page unless it is taller than a page anyway
+            if block.height() <= self.page_height - 2 * self.margin:
+                self._new_page()
+            else:
+                self.y -= BLOCK_GAP
+        else:
+            self.y -= BLOCK_GAP
+
+        for size, line in block.lines:
+            line_height = block.line_height(size)
+            if self.y - line_height < bottom:
+                self._new_page()
+            self.y -= line_height
+            if size is None:
+                rule_y = self.y + line_height / 2
+                self.ops.append(f"0.5 w {self.margin} {rule_y:.2f} m "
+                                f"{self.page_width - self.margin} {rule_y:.2f} l S")
+                continue
+            x = self.margin
+            for font, run in split_runs(line):
+                self.ops.append(f"BT /{font} {size} Tf 1 0 0 1 {x:.2f} {self.y:.2f} Tm "
+                                f"{pdf_string(font, run)} Tj ET")
+                x += text_width(run, size)
+
+    def to_pdf(self):
+        """Serialize the laid-out pages as PDF bytes"""
+        if not self.pages:
+            self._new_page()
+        objects = [
+            "<< /Type /Catalog /Pages 2 0 R >>",
+            None,  # page tree, filled in below
+            "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+            "<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light /Encoding /UniGB-UTF16-H "
+            "/DescendantFonts [5 0 R] >>",
+            "<< /Type /Font /Subtype /CIDFontType0 /BaseFont /STSong-Light "
+            "/CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) /Supplement 4 >> "
+            "/FontDescriptor 6 0 R /DW 1000 >>",
+            "<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 "
+            "/FontBBox [-25 -254 1000 880] /ItalicAngle 0 /Ascent 880 /Descent -120 "
+            "/CapHeight 880 /StemV 93 >>",
+        ]
+        page_refs = []
+        for ops in self.pages:
+            content = zlib.compress("\n".join(ops).encode('cp1252'))
+            objects.append((f"<< /Length {len(content)} /Filter /FlateDecode >>", content))
+            content_ref = len(objects)
+            objects.append(
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {self.page_width} {self.page_height}] "
+                f"/Resources << /Font << /{LATIN_FONT} 3 0 R /{CJK_FONT} 4 0 R >> >> "
+                f"/Contents {content_ref} 0 R >>")
+            page_refs.append(f"{len(objects)} 0 R")
+        objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>"
+
+        out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, obj in enumerate(objects, start=1):
+            offsets.append(len(out))
+            out += f"{number} 0 obj\n".encode()
+            if isinstance(obj, tuple):
+                header, stream = obj
+                out += header.encode() + b"\nstream\n" + stream + b"\nendstream"
+            else:
+                out += obj.encode()
+            out += b"\nendobj\n"
+        xref = len(out)
+        out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+        for offset in offsets:
+            out += f"{offset:010d} 00000 n \n".encode()
+        out += (f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+                f"startxref\n{xref}\n%%EOF\n").encode()
+        return bytes(out)
+
+
+def render_messages(messages, page_size=PAGE_SIZE):
+    """Lay out (sender, text, timestamp) tuples and return (pdf bytes, page count)"""
+    layout = PageLayout(page_size)
+    for sender, text, timestamp in messages:
+        layout.add_message(sender, text, timestamp)
+    return layout.to_pdf(), len(layout.pages)
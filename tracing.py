@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""End-to-end tracing from shutter to paper.
+
+Every message carries a trace id and the sender's stage timestamps
+(capture, encode, publish). Each side appends what it sees to
+traces/<site>.jsonl: the sender adds `broker` when the broker acknowledges
+the publish, the receiving portal adds portal_receive, composite, submit and
+printed. Portals also estimate the clock offset to the other site through
+the heartbeat, so the report can put every timestamp on one clock.
+
+The broker's ack isn't a step on the way to paper (the receiver can get the
+message before the sender gets its PUBACK), so it's reported on its own as
+the sender-side publish → broker ack time.
+
+    python3 tracing.py report traces/*.jsonl
+"""
+import glob
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+TRACE_DIR = "traces"
+STAGES = ['capture', 'encode', 'publish', 'portal_receive', 'composite', 'submit', 'printed']
+ACK_STAGE = 'broker'  # sender's PUBACK time, compared with publish only
+ACK_NAME = 'publish → broker ack (sender)'
+OFFSET_SAMPLES = 50  # clock samples kept per peer
+BEST_SAMPLES = 0.25  # fraction of lowest-RTT samples used for the offset estimate
+
+
+def new_trace(origin):
+    """Start a trace to embed in an outgoing message"""
+    return {'id': uuid.uuid4().hex[:16], 'origin': origin, 'stages': {}}
+
+
+def stamp(trace, stage, t=None):
+    trace['stages'][stage] = time.time() if t is None else t
+    return trace
+
+
+class TraceLog:
+    """Appends trace records for one site to traces/<site>.jsonl"""
+
+    def __init__(self, site, root=TRACE_DIR):
+        self.site = site
+        self.path = os.path.join(root, f"{site}.jsonl")
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _append(self, record):
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+
+    def record(self, trace_id, stage, t=None, clock=None):
+        """Log one stage; clock names the site whose clock t was read from"""
+        self._append({'trace': trace_id, 'site': self.site, 'clock': clock or self.site,
+                      'stage': stage, 't': time.time() if t is None else t})
+
+    def record_trace(self, trace):
+        """Log the stages a message arrived with (stamped on the sender's clock)"""
+        for stage, t in trace.get('stages', {}).items():
+            self.record(trace['id'], stage, t, clock=trace.get('origin'))
+
+    def record_offset(self, peer, offset, rtt):
+        self._append({'type': 'clock', 'site': self.site, 'peer': peer,
+                      'offset': offset, 'rtt': rtt, 't': time.time()})
+
+
+class ClockSync:
+    """NTP-style offset estimate to a peer portal, piggybacked on the heartbeat.
+
+    We send {t0}; the peer answers {t0, t1, t2} with its receive and reply
+    times; on receipt at t3, offset = ((t1 - t0) + (t2 - t3)) / 2 is how far
+    the peer's clock is ahead of ours.
+    """
+
+    def __init__(self, site, peer, log=None):
+        self.site = site
+        self.peer = peer
+        self.log = log
+        self.samples = []  # (rtt, offset)
+        self.pending = []  # t0 of our unanswered pings (fleet instances share the reply topic)
+        self.lock = threading.Lock()
+
+    def ping(self):
+        t0 = time.time()
+        with self.lock:
+            self.pending.append(t0)
+            del self.pending[:-OFFSET_SAMPLES]
+        return json.dumps({'from': self.site, 't0': t0})
+
+    def handle(self, payload):
+        """Handle a clock message; returns a reply payload to send back, if any"""
+        received = time.time()
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return None
+        if 't1' not in data:
+            if data.get('from') == self.site:
+                return None
+            return json.dumps({'from': self.site, 't0': data.get('t0'), 't1': received, 't2': time.time()})
+
+        t0, t1, t2, t3 = data['t0'], data['t1'], data['t2'], received
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        rtt = (t3 - t0) - (t2 - t1)
+        with self.lock:
+            if t0 not in self.pending:
+                return None  # another instance's ping, or a duplicate
+            self.pending.remove(t0)
+            self.samples.append((rtt, offset))
+            del self.samples[:-OFFSET_SAMPLES]
+        if self.log:
+            self.log.record_offset(self.peer, offset, rtt)
+        return None
+
+    def offset(self):
+        with self.lock:
+            return best_offset([{'rtt': rtt, 'offset': offset} for rtt, offset in self.samples])
+
+
+def best_offset(samples):
+    """Median offset of the lowest-RTT samples (None without samples)"""
+    if not samples:
+        return None
+    ordered = sorted(samples, key=lambda s: s['rtt'])
+    best = ordered[:max(1, int(len(ordered) * BEST_SAMPLES))]
+    return statistics.median(s['offset'] for s in best)
+
+
+# ===== report =====
+
+def load(paths):
+    records, clocks = [], []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                (clocks if record.get('type') == 'clock' else records).append(record)
+    return records, clocks
+
+
+def offsets_to(reference, clocks):
+    """Seconds to subtract from each site's timestamps to put them on the reference clock"""
+    pairs = {}
+    for sample in clocks:
+        # offset = peer clock - site clock
+        pairs.setdefault((sample['site'], sample['peer']), []).append(sample)
+    offsets = {reference: 0.0}
+    for (site, peer), samples in pairs.items():
+        estimate = best_offset(samples)
+        if site == reference and peer not in offsets:
+            offsets[peer] = estimate
+        elif peer == reference and site not in offsets:
+            offsets[site] = -estimate
+    return offsets
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(paths):
+    records, clocks = load(paths)
+    if not records:
+        print("No trace records found")
+        return
+
+    traces = {}
+    for record in records:
+        traces.setdefault(record['trace'], []).append(record)
+
+    # Put everything on the clock of the site that printed (the receiver)
+    printers = [r['site'] for r in records if r['stage'] == 'printed']
+    reference = statistics.mode(printers) if printers else records[0]['site']
+    offsets = offsets_to(reference, clocks)
+    missing = sorted({r['clock'] for r in records if r['clock'] not in offsets})
+    if missing:
+        print(f"⚠ no clock samples for {', '.join(missing)} - their stages are left uncorrected")
+
+    durations = {}
+    totals = []
+    acks = []
+    for trace_id, trace_records in traces.items():
+        times = {}
+        for r in trace_records:
+            times.setdefault(r['stage'], r['t'] - (offsets.get(r['clock']) or 0.0))
+        if ACK_STAGE in times and 'publish' in times:
+            acks.append(times[ACK_STAGE] - times['publish'])  # both on the sender's clock
+        present = [stage for stage in STAGES if stage in times]
+        for before, after in zip(present, present[1:]):
+            durations.setdefault(f"{before} → {after}", []).append(times[after] - times[before])
+        if len(present) > 1:
+            totals.append(times[present[-1]] - times[present[0]])
+
+    print(f"{len(traces)} trace(s), times on {reference}'s clock "
+          f"({', '.join(f'{site} {offset * 1000:+.0f} ms' for site, offset in offsets.items() if site != reference) or 'single site'})")
+    print(f"{'stage':<32}{'n':>6}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    ordered = sorted(durations, key=lambda name: STAGES.index(name.split(' → ')[0]))
+    durations[ACK_NAME] = acks
+    durations['end to end'] = totals
+    for name in ordered + [ACK_NAME, 'end to end']:
+        values = durations[name]
+        if not values:
+            continue
+        print(f"{name:<32}{len(values):>6}" + "".join(
+            f"{percentile(values, q) * 1000:>8.0f}ms" for q in (0.5, 0.9, 0.99)) + f"{max(values) * 1000:>8.0f}ms")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'report':
+        print("Usage: python3 tracing.py report [trace files...]")
+        sys.exit(1)
+    report(sys.argv[2:] or glob.glob(os.path.join(TRACE_DIR, '*.jsonl')))